@@ -1,311 +1,1344 @@
 from collections import OrderedDict
 from collections import defaultdict
+from collections import namedtuple
+from array import array
+from Significance import compareAllPairs
+import cPickle as pickle
 import numpy as np
+import multiprocessing
+import itertools
+import argparse
+import mmap
+import hashlib
 import glob
 import os
 import re
 
-systemResults = OrderedDict() # Dictionary where key = systemID and value = Dictionary, where key = queryID and value = [(docID, rank, score)]
+RunArrays = namedtuple('RunArrays', ['queryIDs', 'offsets', 'docIDs', 'scores']) # Columnar results of a system: the ranking of queryIDs[i] is docIDs[offsets[i]:offsets[i+1]] (int32) with scores (float32), ranks are implicit from position
+
+systemResults = OrderedDict() # Dictionary where key = systemID and value = RunArrays
+QrelsIndex = namedtuple('QrelsIndex', ['keys', 'gains', 'idealDCG']) # Sorted (queryID, docID) keys with their gains, and per query ideal DCG at every cutoff, see buildQrelsIndex
+
 queryRelevantDocuments = OrderedDict() # Dictionary where key = queryID and value = [(documentID, relevance value)]
+qrelsIndex = QrelsIndex(np.zeros(0, dtype = np.int64), np.zeros(0), OrderedDict()) # Index over queryRelevantDocuments, rebuilt whenever it is imported
+discountVector = np.ones(0) # Cached log2 discount for each rank, see getDiscountVector
+defaultMeasures = ['P@10', 'R@50', 'r-Precision', 'AP', 'nDCG@10', 'nDCG@20'] # Columns of the *.eval files
+cacheFolder = '.eval_cache' # Folder next to the input files holding their parsed arrays
+storeFile = '.eval_store' # File in the output folder holding the per query measures of the incremental mode
 
 def main():
-    importResultsFiles('systems/')
-    importRelevantDocuments('systems/qrels.txt')
-    calculateMeasures()
+    parser = argparse.ArgumentParser(description = 'Evaluates the *.results files in systems/ against systems/qrels.txt')
+    parser.add_argument('--measures', default = ','.join(defaultMeasures), help = 'Comma separated measures, e.g. P@5,P@10,R@50,r-Precision,AP,nDCG@10 (default: %(default)s)')
+    parser.add_argument('--processes', type = int, default = 1, help = 'Number of worker processes - with --incremental only the significance tests use them (default: %(default)s)')
+    parser.add_argument('--shard-size', type = int, default = 500, help = 'Maximum number of queries per parallel task (default: %(default)s)')
+    parser.add_argument('--streaming', action = 'store_true', help = 'Evaluate the results files one query at a time instead of loading them into memory')
+    parser.add_argument('--no-cache', action = 'store_true', help = 'Always parse the text files instead of using the parsed copies in systems/' + cacheFolder)
+    parser.add_argument('--incremental', action = 'store_true', help = 'Only recompute the queries whose rankings or relevant documents changed since the last incremental run')
+    parser.add_argument('--significance', default = '', help = 'Comma separated measures (out of --measures) to compare all pairs of systems on, e.g. AP,nDCG@10')
+    parser.add_argument('--permutations', type = int, default = 10000, help = 'Number of sign flips of the permutation test (default: %(default)s)')
+    parser.add_argument('--bootstrap-samples', type = int, default = 10000, help = 'Number of resamples of the bootstrap confidence interval (default: %(default)s)')
+    arguments = parser.parse_args()
+    measureNames = arguments.measures.split(',')
+    significanceMeasures = filter(None, arguments.significance.split(','))
+    for name in significanceMeasures:
+        if name not in measureNames:
+            parser.error('--significance measure {} is not in --measures'.format(name))
+    if arguments.incremental and arguments.streaming:
+        parser.error('--incremental reads the changed results files whole and cannot be combined with --streaming')
+    if arguments.incremental and arguments.processes > 1 and not significanceMeasures:
+        parser.error('--incremental evaluates in a single process - --processes only applies to its --significance tests')
+
+    importRelevantDocuments('systems/qrels.txt', not arguments.no_cache)
+    if arguments.incremental:
+        measures = calculateMeasuresIncremental('systems/', measureNames, not arguments.no_cache)
+    elif arguments.streaming:
+        measures = calculateMeasuresStreaming('systems/', measureNames, arguments.processes)
+    else:
+        importResultsFiles('systems/', not arguments.no_cache)
+        measures = calculateMeasures(measureNames, arguments.processes, arguments.shard_size)
+    for name in significanceMeasures:
+        exportSignificance("eval_out/", measures, name, arguments.permutations, arguments.bootstrap_samples, arguments.processes)
+
+class Evaluator(object):
+    """Evaluates rankings against a set of relevant documents that is loaded and indexed once
+
+    The evaluator does not change after it is created and uses none of the module's global state, so several
+    evaluators can live in one process and evaluate may be called from many threads at the same time.
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to a qrels file, e.g. 'systems/qrels.txt'
+    queryRelevantDocuments : Dictionary type
+        Instead of a file: Dictionary where key = queryID and value = Dictionary, where key = documentID and value = relevance value
+    useCache : Boolean type
+        Whether to use the binary cache when reading the qrels file
+    """
+
+    def __init__(self, pathToFile = None, queryRelevantDocuments = None, useCache = True):
+        if (pathToFile is None) == (queryRelevantDocuments is None):
+            raise ValueError('Give either a qrels file or the relevant documents')
+        if pathToFile is not None:
+            queryRelevantDocuments = loadRelevantDocuments(pathToFile, useCache)
+        self.queryRelevantDocuments = OrderedDict((queryID, OrderedDict(relevantDocuments)) for queryID, relevantDocuments in queryRelevantDocuments.iteritems())
+        self.index = createQrelsIndex(self.queryRelevantDocuments)
+
+    def evaluate(self, rankings, measureNames = defaultMeasures):
+        """Calculates the measures for every query of a run
+
+        Parameters
+        ----------
+        rankings : RunArrays or Dictionary type
+            Columnar system results, or Dictionary where key = queryID and value = iterable of document IDs in rank order
+        measureNames : List of strings
+            The measures to calculate, e.g. ['P@10', 'R@50', 'r-Precision', 'AP', 'nDCG@10']
+
+        Returns
+        -------
+        measures : Dictionary type
+            Dictionary where key = measure name and value = Dictionary, where key = queryID and value = measure value
+        """
+        if not isinstance(rankings, RunArrays):
+            rankings = createRunArraysFromRankings(rankings)
+        return evaluateSystem(rankings, measureNames, self.index)
+
+    def evaluateRanking(self, queryID, documentIDs, measureNames = defaultMeasures):
+        """Calculates the measures for a single ranking
+
+        Parameters
+        ----------
+        queryID : Integer type
+            The query ID
+        documentIDs : Iterable type
+            The document IDs in rank order
+        measureNames : List of strings
+            The measures to calculate
+
+        Returns
+        -------
+        measures : Dictionary type
+            Dictionary where key = measure name and value = measure value
+        """
+        return self.evaluateRankings([(queryID, documentIDs)], measureNames)[0]
+
+    def evaluateRankings(self, rankings, measureNames = defaultMeasures):
+        """Calculates the measures for many rankings at once - the same query may appear more than once
+
+        Parameters
+        ----------
+        rankings : List type
+            (queryID, iterable of document IDs in rank order) pairs
+        measureNames : List of strings
+            The measures to calculate
+
+        Returns
+        -------
+        measures : List type
+            One Dictionary per ranking, where key = measure name and value = measure value
+        """
+        if not rankings:
+            return []
+        rows = evaluateRows(createRunArraysFromRankings(rankings), measureNames, self.index)
+        return [OrderedDict((name, float(values[row])) for name, values in rows.iteritems()) for row in range(len(rankings))]
+
+    def hasQuery(self, queryID):
+        """Returns whether the evaluator has relevant documents for the given query
+
+        Parameters
+        ----------
+        queryID : Integer type
+            The query ID
 
-def calculateMeasures():
+        Returns
+        -------
+        known : Boolean type
+            True if the query can be evaluated
+        """
+        return queryID in self.index.idealDCG
+
+def calculateMeasures(measureNames = defaultMeasures, processes = 1, shardSize = 500):
     """Calculates the measures for each system and writes them to file
 
+    Parameters
+    ----------
+    measureNames : List of strings
+        The measures to calculate, e.g. ['P@10', 'R@50', 'r-Precision', 'AP', 'nDCG@10']
+    processes : Integer type
+        Number of worker processes - with more than one, systems and query shards are evaluated in parallel
+    shardSize : Integer type
+        Maximum number of queries of a system evaluated by one parallel task
+
     Returns
     -------
     measures : Dictionary type
-        Results for each system
+        Results for each system, where key = systemID and value = Dictionary, where key = measure name and value = Dictionary, where key = queryID and value = measure value
     """
-    global systemResults, queryRelevantDocuments
+    global systemResults
+
+    measures = OrderedDict()
+    if processes > 1:
+        tasks = []
+        for systemID, run in systemResults.iteritems():
+            for start in range(0, len(run.queryIDs), shardSize):
+                tasks.append((systemID, start, min(start + shardSize, len(run.queryIDs)), measureNames))
+        # Workers are forked after the run files and qrels are loaded, so they read the parent's copy instead of receiving it pickled
+        pool = multiprocessing.Pool(processes)
+        try:
+            shardResults = pool.map(evaluateShard, tasks)
+        finally:
+            pool.close()
+            pool.join()
+        for systemID, shardMeasures in shardResults: # Shards come back in task order, so queries keep their order
+            if systemID not in measures:
+                measures[systemID] = OrderedDict((name, OrderedDict()) for name in measureNames)
+            for name in measureNames:
+                measures[systemID][name].update(shardMeasures[name])
+    else:
+        for systemID, run in systemResults.iteritems():
+            measures[systemID] = evaluateSystem(run, measureNames)
+    exportMeasures("eval_out/", measures, measureNames)
+    return measures
+
+def evaluateShard(task):
+    """Calculates the measures for a subset of the queries of a system - runs inside a worker process
+
+    Parameters
+    ----------
+    task : Tuple type
+        (systemID, first query row, end query row (exclusive), list of measure names)
+
+    Returns
+    -------
+    result : Tuple type
+        (systemID, measures) where measures is returned by evaluateSystem for the given queries
+    """
+    global systemResults
+
+    systemID, start, end, measureNames = task
+    return systemID, evaluateSystem(sliceRun(systemResults[systemID], start, end), measureNames)
+
+def exportMeasures(folder, measures, measureNames, changedSystems = None):
+    """Writes the per query measures of each system to S*.eval and their means to All.eval
+
+    Parameters
+    ----------
+    folder : String type
+        The output directory
+    measures : Dictionary type
+        Results for each system, as returned by calculateMeasures
+    measureNames : List of strings
+        The measures to write, in column order
+    changedSystems : Set type
+        If given, only the S*.eval files of these systems are rewritten - All.eval is always rewritten
+    """
+    global queryRelevantDocuments
 
-    folder = "eval_out/"
     if not os.path.exists(folder): # Check whether the directory exists or not
         os.makedirs(folder)
 
+    header = '\t' + '\t'.join(measureNames) + '\n'
+    rowFormat = '{}' + '\t{:.3f}' * len(measureNames) + '\n'
     with open(folder+'All.eval', 'w') as allFile:
-        allFile.write('\tP@10\tR@50\tr-Precision\tAP\tnDCG@10\tnDCG@20\n')
-        for systemID, results in systemResults.iteritems():
-
-            systemPrecision = precision(results, 10)
-            systemRecall = recall(results, 50)
-            systemRPrecision = r_precision(results)
-            average_precision = averagePrecision(results)
-            nDCG10 = nDCG(results, 10)
-            nDCG20 = nDCG(results, 20)
+        allFile.write(header)
+        for systemID, systemMeasures in measures.iteritems():
+            means = [np.mean(systemMeasures[name].values()) for name in measureNames]
+            allFile.write(rowFormat.format("S"+str(systemID), *means))
+            if changedSystems is not None and systemID not in changedSystems:
+                continue
 
             filename = "S"+str(systemID)+".eval"
             with open(folder+filename, 'w') as output:
-                output.write('\tP@10\tR@50\tr-Precision\tAP\tnDCG@10\tnDCG@20\n')
+                output.write(header)
                 for queryID in queryRelevantDocuments:
-                    output.write('{}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}\n'.format(queryID, systemPrecision[queryID], systemRecall[queryID], systemRPrecision[queryID], average_precision[queryID], nDCG10[queryID], nDCG20[queryID]))
-                output.write('{}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}\n'.format("mean", np.mean(systemPrecision.values()), np.mean(systemRecall.values()), np.mean(systemRPrecision.values()), np.mean(average_precision.values()), np.mean(nDCG10.values()), np.mean(nDCG20.values())))
+                    output.write(rowFormat.format(queryID, *[systemMeasures[name][queryID] for name in measureNames]))
+                output.write(rowFormat.format("mean", *means))
+
+def exportSignificance(folder, measures, measureName, permutations = 10000, bootstrapSamples = 10000, processes = 1):
+    """Tests every pair of systems for a significant difference in a measure and writes the results to Significance_<measure>.eval
 
-            allFile.write('{}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}\n'.format("S"+str(systemID), np.mean(systemPrecision.values()), np.mean(systemRecall.values()), np.mean(systemRPrecision.values()), np.mean(average_precision.values()), np.mean(nDCG10.values()), np.mean(nDCG20.values())))
+    Parameters
+    ----------
+    folder : String type
+        The output directory
+    measures : Dictionary type
+        Results for each system, as returned by calculateMeasures
+    measureName : String type
+        The measure whose per query values are compared
+    permutations : Integer type
+        Number of sign flips of the permutation test
+    bootstrapSamples : Integer type
+        Number of resamples of the bootstrap confidence interval
+    processes : Integer type
+        Number of worker processes the pairs are spread over
 
-def nDCG(systemResults, k):
-    """Calculates the nDCG for the system results
+    Returns
+    -------
+    comparisons : List type
+        The comparison of every pair, as returned by Significance.compareAllPairs
+    """
+    global queryRelevantDocuments
+
+    systemVectors = OrderedDict()
+    for systemID, systemMeasures in measures.iteritems():
+        systemVectors["S"+str(systemID)] = [systemMeasures[measureName][queryID] for queryID in queryRelevantDocuments]
+    comparisons = compareAllPairs(systemVectors, permutations, bootstrapSamples, processes = processes)
+
+    with open(folder+'Significance_'+measureName+'.eval', 'w') as output:
+        output.write('\t\tDifference\tt\tp (t-test)\tp (permutation)\t95% CI low\t95% CI high\n')
+        for comparison in comparisons:
+            output.write('{}\t{}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}\t{:.3f}\n'.format(comparison['systemA'], comparison['systemB'], comparison['meanDifference'], comparison['t'],
+                comparison['pTTest'], comparison['pPermutation'], comparison['confidenceLow'], comparison['confidenceHigh']))
+    return comparisons
+
+def calculateMeasuresIncremental(directory, measureNames = defaultMeasures, useCache = True):
+    """Updates the measures of a persistent store for the queries whose rankings or relevant documents changed and
+    writes them to file - only the S*.eval files of changed systems are rewritten, All.eval is regenerated from the store
 
     Parameters
     ----------
-    systemResults : Dictionary type
-        Dictionary containing system results, where key = queryID and value = [(docID, rank, score)]
-    k : Integer type
-        The cutoff - number of top k results
+    directory : String type
+        The directory leading to the results files
+    measureNames : List of strings
+        The measures to calculate - when they differ from the stored ones everything is recomputed
+    useCache : Boolean type
+        Whether to use the binary cache when a results file has to be read
 
     Returns
     -------
-    nDCG : Dictionary type
-        The nDCG of the system for each query
+    measures : Dictionary type
+        Results for each system, as returned by calculateMeasures
     """
     global queryRelevantDocuments
 
-    nDCG = OrderedDict()
+    folder = "eval_out/"
+    store = loadMeasureStore(folder + storeFile)
+    if store is None or store['measureNames'] != list(measureNames):
+        store = {'measureNames': list(measureNames), 'qrels': {}, 'systems': {}}
+
+    queryFingerprints = dict((queryID, getRelevantDocumentsFingerprint(queryID)) for queryID in queryRelevantDocuments)
+    changedQueries = set(queryID for queryID, fingerprint in queryFingerprints.iteritems() if store['qrels'].get(queryID) != fingerprint)
+
+    measures = OrderedDict()
+    changedSystems = set()
+    systems = {}
+    for resultsFile in sorted(glob.glob(directory+'*.results')):
+        systemID = getSystemID(resultsFile)
+        status = os.stat(resultsFile)
+        stored = store['systems'].get(systemID)
+        fileChanged = stored is None or (stored['path'], stored['size'], stored['modificationTime']) != (resultsFile, status.st_size, status.st_mtime)
+
+        if fileChanged or any(queryID in changedQueries for queryID in stored['rankings']):
+            run = readResultsFile(resultsFile, useCache)
+            rankingFingerprints = OrderedDict((queryID, getRankingFingerprint(documentIDs)) for queryID, documentIDs in iterateRankingArrays(run))
+            previous = stored['rankings'] if stored is not None else {}
+            rows = [row for row, (queryID, fingerprint) in enumerate(rankingFingerprints.iteritems()) if queryID in changedQueries or previous.get(queryID) != fingerprint]
+            storedMeasures = stored['measures'] if stored is not None else dict((name, {}) for name in measureNames)
+            newMeasures = evaluateSystem(selectRows(run, rows), measureNames) if rows else dict((name, {}) for name in measureNames)
 
-    for queryID, results in systemResults.iteritems():
-        numberOfRelevantDocumentsRetrieved = 0
-        numberOfRelevantDocuments = len(queryRelevantDocuments[queryID])
-        sum = 0
-        idealSum = 0
-        numberOfDocs = 0
-        flag = True
-        for counter, entry in enumerate(results):
-            documentID = entry[0]
-            if flag: # Only for the first entry - no discount
-                sum = getDocumentRelevanceValue(queryID, documentID)
-                flag = False
-            else: # For every entry from i=2 onwards
-                sum += float(getDocumentRelevanceValue(queryID, documentID))/float(np.log2(counter + 1))
-            if counter + 1 == k:
-                break
+            # Keep the run's query order, taking recomputed values where there are any
+            systemMeasures = OrderedDict()
+            for name in measureNames:
+                systemMeasures[name] = OrderedDict((queryID, newMeasures[name][queryID] if queryID in newMeasures[name] else storedMeasures[name][queryID]) for queryID in rankingFingerprints)
+            stored = {'path': resultsFile, 'size': status.st_size, 'modificationTime': status.st_mtime, 'rankings': rankingFingerprints, 'measures': systemMeasures}
+            if rows or fileChanged:
+                changedSystems.add(systemID)
+        systems[systemID] = stored
+        measures[systemID] = stored['measures']
 
-        iDCG = getIDCG(queryID, k)
-        nDCG[queryID] = float(sum)/float(iDCG)
-    return nDCG
+    store['qrels'] = queryFingerprints
+    store['systems'] = systems
+    exportMeasures(folder, measures, measureNames, changedSystems)
+    saveMeasureStore(folder + storeFile, store)
+    return measures
 
-def getIDCG(queryID, k):
-    """Calculates the iDCG for a given query at cutoff k
+def loadMeasureStore(pathToFile):
+    """Loads the store of the incremental mode
 
     Parameters
     ----------
-    queryID : Integer type
-        The query ID
-    k : Integer type
-        The cutoff - number of top k results
+    pathToFile : String type
+        The path leading to the store
 
     Returns
     -------
-    iDCG : Float type
-        The iDCG value at k
+    store : Dictionary type
+        The store written by saveMeasureStore, or None if there is none or it cannot be read
     """
-    global queryRelevantDocuments
-    relevanceValuesSorted = sorted(queryRelevantDocuments[queryID].items(), key = lambda (k,v): v, reverse = True)
-    iDCG = 0
-    flag = True
-    for iteration, (documentID, value) in enumerate(relevanceValuesSorted):
-        if flag: # Only for the first entry - no discount
-            iDCG = value
-            flag = False
-        else: # For every entry from i=2 onwards
-            iDCG += float(value)/float(np.log2(iteration + 1))
-        if iteration + 1 == k:
-            break
-    return iDCG
+    if not os.path.exists(pathToFile):
+        return None
+    try:
+        with open(pathToFile, 'rb') as file:
+            return pickle.load(file)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        return None
 
-def getDocumentRelevanceValue(queryID, documentID):
-    """Returns the document gain value for a given query and document
+def saveMeasureStore(pathToFile, store):
+    """Saves the store of the incremental mode
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the store
+    store : Dictionary type
+        'measureNames' = the stored measures, 'qrels' = Dictionary where key = queryID and value = fingerprint of its
+        relevant documents, 'systems' = Dictionary where key = systemID and value = Dictionary with the results file's
+        'path', 'size' and 'modificationTime', the fingerprint of every ranking ('rankings') and the per query 'measures'
+    """
+    temporaryPath = '{}.{}.tmp'.format(pathToFile, os.getpid())
+    with open(temporaryPath, 'wb') as output:
+        pickle.dump(store, output, pickle.HIGHEST_PROTOCOL)
+    os.rename(temporaryPath, pathToFile)
+
+def getRelevantDocumentsFingerprint(queryID):
+    """Returns a fingerprint of the relevant documents of a query
 
     Parameters
     ----------
     queryID : Integer type
         The query ID
-    documentID: Integer type
-        The document ID
 
     Returns
     -------
-    gain : Integer type
-        The relevance value of the specified document
+    fingerprint : String type
+        A digest that changes whenever a document or relevance value of the query changes
     """
     global queryRelevantDocuments
-    if documentID in queryRelevantDocuments[queryID]:
-        return queryRelevantDocuments[queryID][documentID]
-    else:
-        return 0
+    return hashlib.md5(repr(sorted(queryRelevantDocuments[queryID].iteritems()))).hexdigest()
 
-def averagePrecision(systemResults):
-    """Calculates the average precision for the system results
+def getRankingFingerprint(documentIDs):
+    """Returns a fingerprint of a ranking
 
     Parameters
     ----------
-    systemResults : Dictionary type
-        Dictionary containing system results, where key = queryID and value = [(docID, rank, score)]
+    documentIDs : Numpy array type
+        The ranked document IDs
 
     Returns
     -------
-    average_precision : Dictionary type
-        The average precision of the system for each query
+    fingerprint : String type
+        A digest that changes whenever the ranking changes
     """
-    global queryRelevantDocuments
+    return hashlib.md5(np.ascontiguousarray(documentIDs, dtype = np.int32).tostring()).hexdigest()
 
-    average_precision = OrderedDict()
+def parseMeasureName(measureName):
+    """Splits a measure name into the measure and its cutoff
 
-    for queryID, results in systemResults.iteritems():
-        numberOfRelevantDocumentsRetrieved = 0
-        numberOfRelevantDocuments = len(queryRelevantDocuments[queryID])
-        sum = 0.0
-        numberOfDocs = 0
-        for entry in results:
-            documentID = entry[0]
-            numberOfDocs += 1
-            if documentID in queryRelevantDocuments[queryID]:
-                numberOfRelevantDocumentsRetrieved += 1
-                sum += float(numberOfRelevantDocumentsRetrieved)/float(numberOfDocs)
-        average_precision[queryID] = float(sum)/float(numberOfRelevantDocuments)
-    return average_precision
+    Parameters
+    ----------
+    measureName : String type
+        A measure name such as 'P@10', 'R@50', 'nDCG@20', 'r-Precision' or 'AP'
 
-def r_precision(systemResults):
-    """Calculates the r-precision for the system results
+    Returns
+    -------
+    measure : String type
+        One of 'P', 'R', 'nDCG', 'r-Precision' or 'AP'
+    cutoff : Integer type
+        The cutoff k, or None for measures without one
+    """
+    measure, separator, cutoff = measureName.strip().partition('@')
+    if measure in ('P', 'R', 'nDCG') and cutoff.isdigit() and int(cutoff) > 0:
+        return measure, int(cutoff)
+    if measure in ('r-Precision', 'AP') and not separator:
+        return measure, None
+    raise ValueError('Unknown measure: {}'.format(measureName))
+
+def evaluateSystem(systemResults, measureNames, index = None):
+    """Calculates all requested measures for the system results, scanning each ranking once
 
     Parameters
     ----------
-    systemResults : Dictionary type
-        Dictionary containing system results, where key = queryID and value = [(docID, rank, score)]
+    systemResults : RunArrays type
+        Columnar system results, where the ranking of queryIDs[i] is docIDs[offsets[i]:offsets[i+1]]
+    measureNames : List of strings
+        The measures to calculate, e.g. ['P@5', 'P@10', 'R@100', 'AP', 'nDCG@1000']
+    index : QrelsIndex type
+        The relevant documents to evaluate against - the imported qrelsIndex if not given
 
     Returns
     -------
-    r_precision : Dictionary type
-        The r-precision of the system for each query
+    measures : Dictionary type
+        Dictionary where key = measure name and value = Dictionary, where key = queryID and value = measure value
     """
-    global queryRelevantDocuments
+    queryIDs = systemResults.queryIDs.tolist()
+    measures = OrderedDict()
+    for name, values in evaluateRows(systemResults, measureNames, index).iteritems():
+        measures[name] = OrderedDict(zip(queryIDs, values))
+    return measures
 
-    query_rPrecision = OrderedDict()
+def evaluateRows(systemResults, measureNames, index = None):
+    """Calculates all requested measures for every row of the system results - unlike evaluateSystem, a query may
+    appear in several rows, e.g. when candidate rankings of different requests are evaluated together
 
-    for queryID, results in systemResults.iteritems():
-        numberOfRelevantDocumentsRetrieved = 0
-        numberOfRelevantDocuments = len(queryRelevantDocuments[queryID])
-        for counter, entry in enumerate(results):
-            documentID = entry[0]
-            if documentID in queryRelevantDocuments[queryID]:
-                numberOfRelevantDocumentsRetrieved += 1
-            if counter + 1 == numberOfRelevantDocuments:
-                break
-        query_rPrecision[queryID] = float(numberOfRelevantDocumentsRetrieved)/float(numberOfRelevantDocuments)
-    return query_rPrecision
+    Parameters
+    ----------
+    systemResults : RunArrays type
+        Columnar system results
+    measureNames : List of strings
+        The measures to calculate
+    index : QrelsIndex type
+        The relevant documents to evaluate against - the imported qrelsIndex if not given
 
-def recall(systemResults, k):
-    """Calculates the recall for the first k results
+    Returns
+    -------
+    measures : Dictionary type
+        Dictionary where key = measure name and value = Numpy array with the value of every row
+    """
+    parsedMeasures = [parseMeasureName(name) for name in measureNames]
+
+    depth = getRequiredDepth(systemResults, index)
+    queryIDs, gains, judged = buildGainMatrix(systemResults, depth, index)
+    matrices = evaluateGainMatrix(queryIDs, gains, judged, index)
+
+    measures = OrderedDict()
+    for name, (measure, cutoff) in zip(measureNames, parsedMeasures):
+        if cutoff is None:
+            measures[name] = matrices[measure]
+        elif cutoff <= depth:
+            measures[name] = matrices[measure][:, cutoff - 1]
+        elif measure == 'P': # No ranking reaches the cutoff - every relevant document retrieved is in the last column
+            measures[name] = judged.sum(axis = 1) / float(cutoff)
+        else: # Neither the retrieved nor the ideal gains grow past the last column
+            measures[name] = matrices[measure][:, depth - 1]
+    return measures
+
+def getRequiredDepth(systemResults, index = None):
+    """Calculates the number of ranks the gain matrix needs - past the longest ranking and the longest ideal ranking no
+    measure changes any more, so larger cutoffs are derived from the last column instead of widening the matrix
 
     Parameters
     ----------
-    systemResults : Dictionary type
-        Dictionary containing system results, where key = queryID and value = [(docID, rank, score)]
-    k : Integer type
-        The top k number of results
+    systemResults : RunArrays type
+        Columnar system results, where the ranking of queryIDs[i] is docIDs[offsets[i]:offsets[i+1]]
+    index : QrelsIndex type
+        The relevant documents to evaluate against - the imported qrelsIndex if not given
 
     Returns
     -------
-    recall : Dictionary type
-        The recall of the system for each query
+    depth : Integer type
+        The longest ranking or number of relevant documents - whichever is larger
     """
-    global queryRelevantDocuments
+    global qrelsIndex
+    if index is None:
+        index = qrelsIndex
 
-    queryRecall = OrderedDict()
+    depth = 1
+    if len(systemResults.queryIDs) > 0:
+        depth = max(depth, np.diff(systemResults.offsets).max())
+    for queryID in systemResults.queryIDs.tolist():
+        depth = max(depth, len(index.idealDCG[queryID]))
+    return int(depth)
 
-    for queryID, results in systemResults.iteritems():
-        numberOfRelevantDocumentsRetrieved = 0
-        for counter, entry in enumerate(results):
-            documentID = entry[0]
-            if documentID in queryRelevantDocuments[queryID]:
-                numberOfRelevantDocumentsRetrieved += 1
-            if counter + 1 == k:
-                break
-        queryRecall[queryID] = float(numberOfRelevantDocumentsRetrieved)/float(len(queryRelevantDocuments[queryID]))
-    return queryRecall
+def getDiscountVector(depth):
+    """Returns the log2 discount for every rank up to depth - the first rank is not discounted
 
-def precision(systemResults, k):
-    """Calculates the precision for the first k results
+    Parameters
+    ----------
+    depth : Integer type
+        The number of ranks
+
+    Returns
+    -------
+    discount : Numpy array type
+        discount[i] is the value the gain at rank i+1 is divided by
+    """
+    global discountVector
+
+    discount = discountVector # Read the global once, so a concurrent call replacing it cannot hand back a shorter vector
+    if len(discount) < depth: # Grow the cached vector only when a deeper ranking shows up
+        discount = np.log2(np.arange(1, depth + 1, dtype = np.float64))
+        discount[0] = 1.0
+        discountVector = discount
+    return discount[:depth]
+
+def buildGainMatrix(systemResults, depth, index = None):
+    """Turns the system results into dense (queries x ranks) matrices, scanning each ranking once
 
     Parameters
     ----------
-    systemResults : Dictionary type
-        Dictionary containing system results, where key = queryID and value = [(docID, rank, score)]
-    k : Integer type
-        The top k number of results
+    systemResults : RunArrays type
+        Columnar system results, where the ranking of queryIDs[i] is docIDs[offsets[i]:offsets[i+1]]
+    depth : Integer type
+        Number of ranks (columns) of the matrices - shorter rankings are padded with zeros
+    index : QrelsIndex type
+        The relevant documents to evaluate against - the imported qrelsIndex if not given
 
     Returns
     -------
-    precision : Dictionary type
-        The precision of the system for each query
+    queryIDs : List of Integers
+        The query ID of every row
+    gains : Numpy array type
+        gains[q, i] is the relevance value of the document at rank i+1 of query q
+    judged : Numpy array type
+        judged[q, i] is 1 if the document at rank i+1 of query q is in the relevant documents, otherwise 0
     """
-    global queryRelevantDocuments
+    global qrelsIndex
+    if index is None:
+        index = qrelsIndex
+
+    queryIDs = systemResults.queryIDs.tolist()
+    gains = np.zeros((len(queryIDs), depth), dtype = np.float64)
+    judged = np.zeros((len(queryIDs), depth), dtype = np.int64)
+
+    # Row and column of the top depth documents of every ranking
+    lengths = np.minimum(np.diff(systemResults.offsets), depth)
+    rows = np.repeat(np.arange(len(queryIDs)), lengths)
+    columns = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    documentIDs = systemResults.docIDs[systemResults.offsets[rows] + columns]
+
+    if len(index.keys) > 0 and len(documentIDs) > 0:
+        keys = getQrelsKeys(systemResults.queryIDs[rows], documentIDs)
+        positions = np.minimum(np.searchsorted(index.keys, keys), len(index.keys) - 1)
+        found = index.keys[positions] == keys
+        gains[rows[found], columns[found]] = index.gains[positions[found]]
+        judged[rows[found], columns[found]] = 1
+    return queryIDs, gains, judged
+
+def iterateRankingArrays(systemResults):
+    """Iterates over the rankings of the system results without converting them to lists
+
+    Parameters
+    ----------
+    systemResults : RunArrays type
+        Columnar system results
+
+    Returns
+    -------
+    rankings : Generator type
+        Yields (queryID, docIDs array view) for every query
+    """
+    offsets = systemResults.offsets.tolist()
+    for row, queryID in enumerate(systemResults.queryIDs.tolist()):
+        yield queryID, systemResults.docIDs[offsets[row]:offsets[row + 1]]
+
+def selectRows(systemResults, rows):
+    """Returns the system results of the given query rows
+
+    Parameters
+    ----------
+    systemResults : RunArrays type
+        Columnar system results
+    rows : List of Integers
+        The query rows to keep, in the order they should appear
+
+    Returns
+    -------
+    systemResults : RunArrays type
+        The system results of the selected queries
+    """
+    rows = np.asarray(rows, dtype = np.int64)
+    lengths = systemResults.offsets[rows + 1] - systemResults.offsets[rows]
+    offsets = np.zeros(len(rows) + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    positions = np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths) + np.repeat(systemResults.offsets[rows], lengths)
+    return RunArrays(systemResults.queryIDs[rows], offsets, systemResults.docIDs[positions], systemResults.scores[positions])
+
+def sliceRun(systemResults, start, end):
+    """Returns the rows start to end (exclusive) of the system results without copying the rankings
+
+    Parameters
+    ----------
+    systemResults : RunArrays type
+        Columnar system results
+    start : Integer type
+        First query row
+    end : Integer type
+        Query row after the last one
+
+    Returns
+    -------
+    systemResults : RunArrays type
+        The system results of the selected queries
+    """
+    first, last = systemResults.offsets[start], systemResults.offsets[end]
+    return RunArrays(systemResults.queryIDs[start:end], systemResults.offsets[start:end + 1] - first,
+                     systemResults.docIDs[first:last], systemResults.scores[first:last])
+
+def createRunArraysFromRankings(rankings):
+    """Builds columnar system results from rankings held in memory
 
-    queryPrecision = OrderedDict()
-
-    for queryID, results in systemResults.iteritems():
-        numberOfRelevantDocumentsRetrieved = 0
-        numberOfRetrievedDocuments = k
-        for counter, entry in enumerate(results):
-            documentID = entry[0]
-            if documentID in queryRelevantDocuments[queryID]:
-                numberOfRelevantDocumentsRetrieved += 1
-            if counter + 1 == k:
-                break
-        queryPrecision[queryID] = float(numberOfRelevantDocumentsRetrieved)/float(numberOfRetrievedDocuments)
-    return queryPrecision
-
-def importResultsFiles(directory):
+    Parameters
+    ----------
+    rankings : Dictionary or List type
+        Dictionary where key = queryID and value = iterable of document IDs in rank order, or a list of
+        (queryID, iterable of document IDs) pairs in which a query may appear more than once
+
+    Returns
+    -------
+    systemResults : RunArrays type
+        The rankings in the given order - scores are not known and set to zero
+    """
+    pairs = rankings.items() if isinstance(rankings, dict) else list(rankings)
+    queryIDs = [queryID for queryID, ranking in pairs]
+    documentIDs = [getInt32Array(ranking if hasattr(ranking, '__len__') else list(ranking), 'Document IDs').ravel() for queryID, ranking in pairs]
+    offsets = np.zeros(len(queryIDs) + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum([len(ranking) for ranking in documentIDs])
+    documentIDs = np.concatenate(documentIDs) if documentIDs else np.zeros(0, dtype = np.int32)
+    return RunArrays(getInt32Array(queryIDs, 'Query IDs'), offsets, documentIDs, np.zeros(len(documentIDs), dtype = np.float32))
+
+def getInt32Array(values, name):
+    """Converts IDs to an int32 array - IDs that int32 cannot hold are refused instead of silently wrapping around to
+    other, possibly relevant, IDs
+
+    Parameters
+    ----------
+    values : Array type
+        The IDs
+    name : String type
+        What the IDs are, for the error message
+
+    Returns
+    -------
+    array : Numpy array type
+        The IDs as int32
+
+    Raises
+    ------
+    ValueError
+        If an ID is not an integer or outside the int32 range
+    """
+    array = np.asarray(values)
+    if array.size == 0:
+        return np.zeros(array.shape, dtype = np.int32)
+    if array.dtype.kind not in 'iu': # Booleans, floats, strings and integers beyond int64 (object arrays)
+        raise ValueError('{} must be integers'.format(name))
+    limits = np.iinfo(np.int32)
+    if array.min() < limits.min or array.max() > limits.max:
+        raise ValueError('{} must be between {} and {}'.format(name, limits.min, limits.max))
+    return array.astype(np.int32)
+
+def createRunArrays(queryIDs, documentIDs, scores):
+    """Groups per line values of a results file into columnar system results
+
+    Parameters
+    ----------
+    queryIDs : Array type
+        The query ID of every line
+    documentIDs : Array type
+        The document ID of every line
+    scores : Array type
+        The score of every line
+
+    Returns
+    -------
+    systemResults : RunArrays type
+        The rankings grouped by query, queries in order of first appearance and documents in file order
+    """
+    queryIDs = getInt32Array(queryIDs, 'Query IDs')
+    documentIDs = getInt32Array(documentIDs, 'Document IDs')
+    scores = np.asarray(scores, dtype = np.float32)
+
+    uniqueQueryIDs, firstLines, rows = np.unique(queryIDs, return_index = True, return_inverse = True)
+    appearanceOrder = np.argsort(firstLines, kind = 'mergesort')
+    rowOfQuery = np.empty(len(uniqueQueryIDs), dtype = np.int64)
+    rowOfQuery[appearanceOrder] = np.arange(len(uniqueQueryIDs))
+    lineRows = rowOfQuery[rows]
+    if len(lineRows) > 1 and np.any(lineRows[1:] < lineRows[:-1]): # Only reorder when the queries are not contiguous
+        order = np.argsort(lineRows, kind = 'mergesort')
+        documentIDs, scores = documentIDs[order], scores[order]
+
+    offsets = np.zeros(len(uniqueQueryIDs) + 1, dtype = np.int64)
+    offsets[1:] = np.cumsum(np.bincount(lineRows, minlength = len(uniqueQueryIDs)))
+    return RunArrays(uniqueQueryIDs[appearanceOrder], offsets, documentIDs, scores)
+
+def evaluateGainMatrix(queryIDs, gains, judged, index = None):
+    """Calculates every measure at every cutoff from the gain matrices using cumulative sums
+
+    Parameters
+    ----------
+    queryIDs : List of Integers
+        The query ID of every row
+    gains : Numpy array type
+        Relevance value of the document at every rank, as returned by buildGainMatrix
+    judged : Numpy array type
+        Relevance indicator of the document at every rank, as returned by buildGainMatrix
+    index : QrelsIndex type
+        The relevant documents to evaluate against - the imported qrelsIndex if not given
+
+    Returns
+    -------
+    measures : Dictionary type
+        'P', 'R' and 'nDCG' map to (queries x ranks) arrays where column i holds the measure at cutoff i+1,
+        'r-Precision' and 'AP' map to arrays with one value per query
+    """
+    global qrelsIndex
+    if index is None:
+        index = qrelsIndex
+
+    depth = gains.shape[1]
+    ranks = np.arange(1, depth + 1, dtype = np.float64)
+    discount = getDiscountVector(depth)
+    numberOfRelevantDocuments = np.array([len(index.idealDCG[queryID]) for queryID in queryIDs], dtype = np.float64)
+
+    idealDCG = np.empty(gains.shape, dtype = np.float64)
+    for row, queryID in enumerate(queryIDs):
+        values = index.idealDCG[queryID][:depth]
+        idealDCG[row, :len(values)] = values
+        idealDCG[row, len(values):] = values[-1] if len(values) > 0 else 0.0 # No more relevant documents - the ideal DCG stays the same
+
+    relevantRetrieved = np.cumsum(judged, axis = 1)
+    precisionAtRank = relevantRetrieved / ranks
+    rows = np.arange(len(queryIDs))
+
+    measures = OrderedDict()
+    measures['P'] = precisionAtRank
+    measures['R'] = relevantRetrieved / numberOfRelevantDocuments[:, np.newaxis]
+    measures['r-Precision'] = relevantRetrieved[rows, numberOfRelevantDocuments.astype(np.int64) - 1] / numberOfRelevantDocuments
+    measures['AP'] = np.cumsum(np.where(judged == 1, precisionAtRank, 0.0), axis = 1)[:, -1] / numberOfRelevantDocuments
+    measures['nDCG'] = np.cumsum(gains / discount, axis = 1) / idealDCG
+    return measures
+
+def importResultsFiles(directory, useCache = True):
     """Reads ranked results from given results file and stores them into memory
 
     Parameters
     ----------
     directory : String type
         The directory leading to the results files
+    useCache : Boolean type
+        Whether to load unchanged files from (and save parsed files to) the binary cache
     """
     global systemResults
 
     for resultsFile in sorted(glob.glob(directory+'*.results')):
-        with open(resultsFile, 'r') as file:
-            systemID = int(resultsFile.split(".")[0][-1])
-            systemResults[systemID] = OrderedDict()
-            for line in file:
-                if line == "\n": # Skip empty lines
-                    continue
-                lineParts = line.strip().split(" ")
-                lineParts = lineParts[0:1] + lineParts[2:-1]
-                queryID, documentID, rank, score = lineParts
-                if int(queryID) not in systemResults[systemID]:
-                    systemResults[systemID][int(queryID)] = []
-                systemResults[systemID][int(queryID)].append((int(documentID), int(rank), float(score)))
-
-def importRelevantDocuments(pathToFile):
+        systemResults[getSystemID(resultsFile)] = readResultsFile(resultsFile, useCache)
+
+def readResultsFile(pathToFile, useCache = True):
+    """Reads a results file, from the binary cache when it is unchanged
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the results file
+    useCache : Boolean type
+        Whether to load an unchanged file from (and save a parsed file to) the binary cache
+
+    Returns
+    -------
+    systemResults : RunArrays type
+        The rankings of the file
+    """
+    cached = loadCachedArrays(pathToFile) if useCache else None
+    if cached is not None:
+        return RunArrays(*[cached[field] for field in RunArrays._fields])
+    try:
+        run = mapResultsFile(pathToFile)
+    except ValueError: # Not the plain six column layout the bulk parser handles - read it line by line
+        run = parseResultsFile(pathToFile)
+    if useCache:
+        saveCachedArrays(pathToFile, run._asdict())
+    return run
+
+def parseResultsFile(pathToFile):
+    """Parses a results file into columnar system results
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the results file
+
+    Returns
+    -------
+    systemResults : RunArrays type
+        The rankings of the file
+    """
+    queryIDs, documentIDs, scores = array('i'), array('i'), array('f')
+    with open(pathToFile, 'r') as file:
+        for line in file:
+            if line == "\n": # Skip empty lines
+                continue
+            queryID, (documentID, rank, score) = parseResultsLine(line)
+            queryIDs.append(queryID)
+            documentIDs.append(documentID)
+            scores.append(score)
+    return createRunArrays(queryIDs, documentIDs, scores)
+
+def mapResultsFile(pathToFile, chunkSize = 1 << 24):
+    """Parses a results file by memory mapping it and converting whole chunks of bytes to numbers at once
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the results file - every non empty line must hold six whitespace separated columns
+        with integer query and document IDs and a decimal score
+    chunkSize : Integer type
+        Approximate number of bytes parsed at a time - chunks always end at a line boundary
+
+    Returns
+    -------
+    systemResults : RunArrays type
+        The rankings of the file
+
+    Raises
+    ------
+    ValueError
+        If the file does not follow the layout above
+    """
+    queryIDs, documentIDs, scores = [], [], []
+    with open(pathToFile, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size > 0:
+            mapped = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+            try:
+                start = 0
+                while start < size:
+                    end = size if start + chunkSize >= size else mapped.rfind('\n', start, start + chunkSize) + 1
+                    if end <= start: # A single line longer than the chunk - take everything up to its end
+                        end = mapped.find('\n', start + chunkSize)
+                        end = size if end < 0 else end + 1
+                    columns = parseResultsChunk(np.frombuffer(mapped, dtype = np.uint8, count = end - start, offset = start))
+                    queryIDs.append(columns[0])
+                    documentIDs.append(columns[1])
+                    scores.append(columns[2])
+                    start = end
+            finally:
+                mapped.close()
+    if not queryIDs:
+        return createRunArrays([], [], [])
+    return createRunArrays(np.concatenate(queryIDs), np.concatenate(documentIDs), np.concatenate(scores))
+
+def parseResultsChunk(data):
+    """Converts a chunk of a results file, made of complete lines, to its query ID, document ID and score columns
+
+    Parameters
+    ----------
+    data : Numpy array type
+        The bytes (uint8) of the chunk
+
+    Returns
+    -------
+    columns : Tuple type
+        (queryIDs, documentIDs, scores) arrays with one entry per line
+    """
+    isSpace = (data == ord(' ')) | (data == ord('\n')) | (data == ord('\t')) | (data == ord('\r'))
+    previousIsSpace = np.concatenate(([True], isSpace[:-1]))
+    nextIsSpace = np.concatenate((isSpace[1:], [True]))
+    tokenStarts = np.flatnonzero(~isSpace & previousIsSpace)
+    tokenEnds = np.flatnonzero(~isSpace & nextIsSpace) + 1
+
+    # Every line must contribute exactly six tokens, and the next token must be on a later line
+    tokenLines = np.searchsorted(np.flatnonzero(data == ord('\n')), tokenStarts)
+    if len(tokenStarts) % 6 != 0 or np.any(tokenLines[0::6] != tokenLines[5::6]) or np.any(tokenLines[6::6] == tokenLines[5:-1:6]):
+        raise ValueError('Lines do not have six columns')
+
+    queryIDs = parseIntegerTokens(data, tokenStarts[0::6], tokenEnds[0::6])
+    documentIDs = parseIntegerTokens(data, tokenStarts[2::6], tokenEnds[2::6])
+    scores = parseDecimalTokens(data, tokenStarts[4::6], tokenEnds[4::6])
+    return queryIDs, documentIDs, scores
+
+def getTokenCharacters(data, starts, ends):
+    """Gathers the characters of the given tokens into a (tokens x longest token) matrix
+
+    Parameters
+    ----------
+    data : Numpy array type
+        The bytes (uint8) of the chunk
+    starts : Numpy array type
+        Offset of the first byte of each token
+    ends : Numpy array type
+        Offset after the last byte of each token
+
+    Returns
+    -------
+    characters : Numpy array type
+        The token bytes, right aligned so that the last character of every token is in the last column
+    present : Numpy array type
+        Whether each cell holds a character of the token or is left padding
+    """
+    lengths = ends - starts
+    width = lengths.max() if len(lengths) > 0 else 1
+    positions = ends[:, np.newaxis] - width + np.arange(width)
+    present = positions >= starts[:, np.newaxis]
+    characters = data[np.where(present, positions, 0)]
+    return characters, present
+
+def parseIntegerTokens(data, starts, ends):
+    """Converts unsigned integer tokens to an int32 array
+
+    Parameters
+    ----------
+    data : Numpy array type
+        The bytes (uint8) of the chunk
+    starts : Numpy array type
+        Offset of the first byte of each token
+    ends : Numpy array type
+        Offset after the last byte of each token
+
+    Returns
+    -------
+    values : Numpy array type
+        The value of every token
+    """
+    characters, present = getTokenCharacters(data, starts, ends)
+    if characters.shape[1] > 9:
+        raise ValueError('Integer too long')
+    digits = characters.astype(np.int64) - ord('0')
+    if np.any(present & ((digits < 0) | (digits > 9))):
+        raise ValueError('Not an integer')
+    powers = 10 ** np.arange(characters.shape[1] - 1, -1, -1, dtype = np.int64)
+    return (np.where(present, digits, 0) * powers).sum(axis = 1).astype(np.int32)
+
+def parseDecimalTokens(data, starts, ends):
+    """Converts decimal tokens, e.g. 5.0743 or -12, to a float32 array
+
+    Parameters
+    ----------
+    data : Numpy array type
+        The bytes (uint8) of the chunk
+    starts : Numpy array type
+        Offset of the first byte of each token
+    ends : Numpy array type
+        Offset after the last byte of each token
+
+    Returns
+    -------
+    values : Numpy array type
+        The value of every token, rounded exactly as float() would before the conversion to float32
+    """
+    characters, present = getTokenCharacters(data, starts, ends)
+    if characters.shape[1] > 19:
+        raise ValueError('Number too long')
+    negative = data[starts] == ord('-')
+    isSign = present & ((characters == ord('-')) | (characters == ord('+')))
+    isSign &= np.cumsum(present, axis = 1) == 1 # A sign is only allowed as the first character
+    isPoint = present & (characters == ord('.'))
+    digits = characters.astype(np.int64) - ord('0')
+    isDigit = present & (digits >= 0) & (digits <= 9)
+    if np.any(present & ~(isDigit | isSign | isPoint)) or np.any(isPoint.sum(axis = 1) > 1) or np.any(isDigit.sum(axis = 1) == 0):
+        raise ValueError('Not a decimal number')
+    if np.any(isDigit.sum(axis = 1) > 15):
+        raise ValueError('Too many digits for an exact conversion')
+
+    # Digits are weighted by their position among the digits only, counted from the right
+    digitPositions = np.cumsum(isDigit[:, ::-1], axis = 1)[:, ::-1] - 1
+    mantissa = (np.where(isDigit, digits * 10 ** np.where(isDigit, digitPositions, 0), 0)).sum(axis = 1)
+    fractionDigits = np.where(isPoint.any(axis = 1), (isDigit & (np.cumsum(isPoint, axis = 1) == 1)).sum(axis = 1), 0)
+    values = mantissa.astype(np.float64) / 10.0 ** fractionDigits # Both operands are exact, so the quotient is correctly rounded
+    return np.where(negative, -values, values).astype(np.float32)
+
+def getCachePath(pathToFile):
+    """Returns the path of the binary cache of a text file, e.g. systems/.eval_cache/S1.results.npz
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the text file
+
+    Returns
+    -------
+    cachePath : String type
+        The path leading to the cache file
+    """
+    directory, filename = os.path.split(pathToFile)
+    return os.path.join(directory, cacheFolder, filename + '.npz')
+
+def loadCachedArrays(pathToFile):
+    """Loads the parsed arrays of a text file from the binary cache
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the text file
+
+    Returns
+    -------
+    arrays : Dictionary type
+        Dictionary where key = array name and value = Numpy array, or None when there is no cache
+        or the text file's size or modification time changed since it was written
+    """
+    cachePath = getCachePath(pathToFile)
+    if not os.path.exists(cachePath):
+        return None
+    status = os.stat(pathToFile)
+    try:
+        with np.load(cachePath) as cache:
+            if cache['sourceSize'] != status.st_size or cache['sourceModificationTime'] != status.st_mtime:
+                return None
+            return dict((name, cache[name]) for name in cache.files)
+    except (IOError, ValueError, KeyError): # Unreadable or incomplete cache - parse the text file again
+        return None
+
+def saveCachedArrays(pathToFile, arrays):
+    """Saves the parsed arrays of a text file to the binary cache, stamped with the file's size and modification time -
+    the cache is only an optimization, so if it cannot be written (e.g. a read only directory) a warning is printed and
+    the evaluation goes on without it
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the text file
+    arrays : Dictionary type
+        Dictionary where key = array name and value = Numpy array
+    """
+    cachePath = getCachePath(pathToFile)
+    temporaryPath = '{}.{}.tmp'.format(cachePath, os.getpid())
+    try:
+        if not os.path.exists(os.path.dirname(cachePath)): # Check whether the directory exists or not
+            os.makedirs(os.path.dirname(cachePath))
+        status = os.stat(pathToFile)
+        with open(temporaryPath, 'wb') as output:
+            np.savez(output, sourceSize = np.int64(status.st_size), sourceModificationTime = np.float64(status.st_mtime), **arrays)
+        os.rename(temporaryPath, cachePath) # Readers never see a partially written cache
+    except (OSError, IOError) as error:
+        print('Warning: not caching {} - {}'.format(pathToFile, error))
+        if os.path.exists(temporaryPath):
+            os.remove(temporaryPath)
+
+def getSystemID(pathToFile):
+    """Returns the system ID encoded in a results file name, e.g. 3 for systems/S3.results
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the results file
+
+    Returns
+    -------
+    systemID : Integer type
+        The system ID
+    """
+    return int(pathToFile.split(".")[0][-1])
+
+def parseResultsLine(line):
+    """Parses a line of a results file
+
+    Parameters
+    ----------
+    line : String type
+        A line of the form 'queryID Q0 docID rank score runID'
+
+    Returns
+    -------
+    queryID : Integer type
+        The query ID
+    entry : Tuple type
+        The (docID, rank, score) triplet
+    """
+    lineParts = line.strip().split(" ")
+    lineParts = lineParts[0:1] + lineParts[2:-1]
+    queryID, documentID, rank, score = lineParts
+    return int(queryID), (int(documentID), int(rank), float(score))
+
+def streamResultsFile(pathToFile):
+    """Reads a results file one query block at a time, keeping only the current ranking in memory
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the results file - the lines of each query must be contiguous
+
+    Returns
+    -------
+    blocks : Generator type
+        Yields the RunArrays of every query, in file order
+    """
+    seenQueries = set()
+    currentQueryID = None
+    documentIDs, scores = array('i'), array('f')
+    with open(pathToFile, 'r') as file:
+        for line in file:
+            if line == "\n": # Skip empty lines
+                continue
+            queryID, (documentID, rank, score) = parseResultsLine(line)
+            if queryID != currentQueryID:
+                if currentQueryID is not None:
+                    yield createRunArrays([currentQueryID] * len(documentIDs), documentIDs, scores)
+                if queryID in seenQueries:
+                    raise ValueError('{}: results of query {} are not contiguous'.format(pathToFile, queryID))
+                seenQueries.add(queryID)
+                currentQueryID = queryID
+                documentIDs, scores = array('i'), array('f')
+            documentIDs.append(documentID)
+            scores.append(score)
+    if currentQueryID is not None:
+        yield createRunArrays([currentQueryID] * len(documentIDs), documentIDs, scores)
+
+def evaluateResultsFile(task):
+    """Streams a results file and calculates the measures query by query - also used as a worker task
+
+    Parameters
+    ----------
+    task : Tuple type
+        (path to the results file, list of measure names)
+
+    Returns
+    -------
+    result : Tuple type
+        (systemID, measures) where measures has the same layout as the one returned by evaluateSystem
+    """
+    pathToFile, measureNames = task
+    measures = OrderedDict((name, OrderedDict()) for name in measureNames)
+    for queryResults in streamResultsFile(pathToFile):
+        queryMeasures = evaluateSystem(queryResults, measureNames)
+        for name in measureNames:
+            measures[name].update(queryMeasures[name])
+    return getSystemID(pathToFile), measures
+
+def calculateMeasuresStreaming(directory, measureNames = defaultMeasures, processes = 1):
+    """Calculates the measures for each results file without loading the files into memory and writes them to file
+
+    Parameters
+    ----------
+    directory : String type
+        The directory leading to the results files
+    measureNames : List of strings
+        The measures to calculate
+    processes : Integer type
+        Number of worker processes - with more than one, results files are streamed in parallel
+
+    Returns
+    -------
+    measures : Dictionary type
+        Results for each system, as returned by calculateMeasures
+    """
+    tasks = [(resultsFile, measureNames) for resultsFile in sorted(glob.glob(directory+'*.results'))]
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            fileResults = pool.map(evaluateResultsFile, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        fileResults = itertools.imap(evaluateResultsFile, tasks) # Lazily, so only one file is open at a time
+
+    measures = OrderedDict()
+    for systemID, systemMeasures in fileResults:
+        measures[systemID] = systemMeasures
+    exportMeasures("eval_out/", measures, measureNames)
+    return measures
+
+def importRelevantDocuments(pathToFile, useCache = True):
     """Reads the relevant documents for each query and stores them into memory
 
     Parameters
     ----------
     pathToFile : String type
         The path leading to the file
+    useCache : Boolean type
+        Whether to load an unchanged file from (and save a parsed file to) the binary cache
     """
     global queryRelevantDocuments
 
+    for queryID, relevantDocuments in loadRelevantDocuments(pathToFile, useCache).iteritems():
+        if queryID not in queryRelevantDocuments:
+            queryRelevantDocuments[queryID] = OrderedDict()
+        queryRelevantDocuments[queryID].update(relevantDocuments)
+    buildQrelsIndex()
+
+def loadRelevantDocuments(pathToFile, useCache = True):
+    """Reads the relevant documents for each query, from the binary cache when the file is unchanged
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the file
+    useCache : Boolean type
+        Whether to load an unchanged file from (and save a parsed file to) the binary cache
+
+    Returns
+    -------
+    relevantDocuments : Dictionary type
+        Dictionary where key = queryID and value = Dictionary, where key = documentID and value = relevance value
+    """
+    cached = loadCachedArrays(pathToFile) if useCache else None
+    if cached is not None:
+        queryIDs, documentIDs, values = cached['queryIDs'], cached['docIDs'], cached['values']
+    else:
+        queryIDs, documentIDs, values = parseRelevantDocumentsFile(pathToFile)
+        if useCache:
+            saveCachedArrays(pathToFile, {'queryIDs': queryIDs, 'docIDs': documentIDs, 'values': values})
+
+    relevantDocuments = OrderedDict()
+    for queryID, documentID, value in itertools.izip(queryIDs.tolist(), documentIDs.tolist(), values.tolist()):
+        if queryID not in relevantDocuments:
+            relevantDocuments[queryID] = OrderedDict()
+        relevantDocuments[queryID][documentID] = value
+    return relevantDocuments
+
+def getQrelsKeys(queryIDs, documentIDs):
+    """Combines query and document IDs into the int64 keys of the qrels index
+
+    Parameters
+    ----------
+    queryIDs : Numpy array type
+        The query IDs
+    documentIDs : Numpy array type
+        The document IDs
+
+    Returns
+    -------
+    keys : Numpy array type
+        One key per (queryID, documentID) pair - query ID in the high and document ID in the low 32 bits
+    """
+    return (queryIDs.astype(np.int64) << 32) | (documentIDs.astype(np.int64) & 0xFFFFFFFF)
+
+def buildQrelsIndex():
+    """Rebuilds qrelsIndex from queryRelevantDocuments
+    """
+    global queryRelevantDocuments, qrelsIndex
+    qrelsIndex = createQrelsIndex(queryRelevantDocuments)
+
+def createQrelsIndex(queryRelevantDocuments):
+    """Builds the index over the relevant documents used by the measures: sorted (queryID, docID) keys for
+    the gain lookup of whole rankings with searchsorted, and the ideal DCG of every query at every cutoff
+
+    Parameters
+    ----------
+    queryRelevantDocuments : Dictionary type
+        Dictionary where key = queryID and value = Dictionary, where key = documentID and value = relevance value
+
+    Returns
+    -------
+    index : QrelsIndex type
+        The index over the relevant documents
+    """
+    queryIDs, documentIDs, values = [], [], []
+    idealDCG = OrderedDict()
+    for queryID, relevantDocuments in queryRelevantDocuments.iteritems():
+        queryIDs.extend([queryID] * len(relevantDocuments))
+        documentIDs.extend(relevantDocuments.keys())
+        values.extend(relevantDocuments.values())
+        idealGains = np.array(sorted(relevantDocuments.values(), reverse = True), dtype = np.float64)
+        idealDCG[queryID] = np.cumsum(idealGains / getDiscountVector(len(idealGains)))
+
+    keys = getQrelsKeys(np.array(queryIDs, dtype = np.int64), np.array(documentIDs, dtype = np.int64))
+    order = np.argsort(keys)
+    return QrelsIndex(keys[order], np.array(values, dtype = np.float64)[order], idealDCG)
+
+def parseRelevantDocumentsFile(pathToFile):
+    """Parses the relevant documents file into flat arrays, one entry per (query, document) pair in file order
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the file
+
+    Returns
+    -------
+    queryIDs : Numpy array type
+        The query ID of every pair
+    documentIDs : Numpy array type
+        The document ID of every pair
+    values : Numpy array type
+        The relevance value of every pair
+    """
+    queryIDs, documentIDs, values = array('i'), array('i'), array('i')
     with open(pathToFile, 'r') as file:
         for line in file:
             if line == "\n": # Skip empty lines
                 continue
             lineParts = line.strip().split(":")
             queryID = int(lineParts[0])
-            if queryID not in queryRelevantDocuments:
-                queryRelevantDocuments[queryID] = OrderedDict()
 
             docIDRelevanceList = re.split(r'(?!\,)\W+', lineParts[1].strip())
             docIDRelevanceList = filter(None, docIDRelevanceList)
 
             for pair in docIDRelevanceList:
                 documentID, value = pair.strip().split(",")
-                queryRelevantDocuments[queryID][int(documentID)] = int(value)
+                queryIDs.append(queryID)
+                documentIDs.append(int(documentID))
+                values.append(int(value))
+    return np.array(queryIDs, dtype = np.int32), np.array(documentIDs, dtype = np.int32), np.array(values, dtype = np.int32)
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""Eval_Server.py : Module that serves the IR measures of candidate rankings over HTTP on localhost"""
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from Eval import Evaluator, defaultMeasures, parseMeasureName
+import threading
+import argparse
+import Queue
+import numpy as np
+import json
+import time
+
+int32Limits = np.iinfo(np.int32) # The range of the evaluator's query and document IDs
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Serves P@k, R@k, r-Precision, AP and nDCG@k of rankings posted to http://127.0.0.1:<port>/evaluate')
+    parser.add_argument('--qrels', default = 'systems/qrels.txt', help = 'The qrels file (default: %(default)s)')
+    parser.add_argument('--port', type = int, default = 8765, help = 'The port to listen on (default: %(default)s)')
+    parser.add_argument('--batch-window', type = float, default = 2.0, help = 'Milliseconds to wait for more requests before evaluating a batch (default: %(default)s)')
+    parser.add_argument('--max-batch-size', type = int, default = 1024, help = 'Maximum number of rankings evaluated together (default: %(default)s)')
+    arguments = parser.parse_args()
+
+    server = createServer(Evaluator(arguments.qrels), arguments.port, arguments.batch_window / 1000.0, arguments.max_batch_size)
+    print('Serving on http://127.0.0.1:{}/evaluate'.format(server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def createServer(evaluator, port = 8765, batchWindow = 0.002, maxBatchSize = 1024):
+    """Creates the evaluation server and starts its batching thread
+
+    Parameters
+    ----------
+    evaluator : Evaluator type
+        The evaluator holding the indexed qrels
+    port : Integer type
+        The port to listen on - 0 picks a free one
+    batchWindow : Float type
+        Seconds to wait for more requests once the first request of a batch arrived
+    maxBatchSize : Integer type
+        Maximum number of rankings evaluated together
+
+    Returns
+    -------
+    server : EvaluationServer type
+        The server, bound to 127.0.0.1 - call serve_forever to handle requests
+    """
+    server = EvaluationServer(('127.0.0.1', port), EvaluationRequestHandler)
+    server.evaluator = evaluator
+    server.batcher = EvaluationBatcher(evaluator, batchWindow, maxBatchSize)
+    return server
+
+class EvaluationServer(ThreadingMixIn, HTTPServer):
+    """HTTP server handling every request in its own thread, so concurrent requests can meet in the batcher"""
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128 # Bursts of concurrent clients must not overflow the listen backlog
+
+class EvaluationBatcher(object):
+    """Collects the rankings of concurrent requests and evaluates them together in a single vectorized pass
+
+    Parameters
+    ----------
+    evaluator : Evaluator type
+        The evaluator holding the indexed qrels
+    batchWindow : Float type
+        Seconds to wait for more requests once the first request of a batch arrived
+    maxBatchSize : Integer type
+        Maximum number of rankings evaluated together
+    """
+
+    def __init__(self, evaluator, batchWindow = 0.002, maxBatchSize = 1024):
+        self.evaluator = evaluator
+        self.batchWindow = batchWindow
+        self.maxBatchSize = maxBatchSize
+        self.pending = Queue.Queue()
+        thread = threading.Thread(target = self.run)
+        thread.daemon = True
+        thread.start()
+
+    def submit(self, rankings, measureNames):
+        """Queues rankings for evaluation and waits for their measures
+
+        Parameters
+        ----------
+        rankings : List type
+            (queryID, list of document IDs in rank order) pairs
+        measureNames : List of strings
+            The measures to calculate
+
+        Returns
+        -------
+        measures : List type
+            One Dictionary per ranking, where key = measure name and value = measure value
+        """
+        request = {'rankings': rankings, 'measureNames': measureNames, 'done': threading.Event(), 'result': None, 'error': None}
+        self.pending.put(request)
+        request['done'].wait()
+        if request['error'] is not None:
+            raise request['error']
+        return request['result']
+
+    def run(self):
+        """Evaluates batches of queued requests until the process exits"""
+        while True:
+            batch = [self.pending.get()]
+            size = len(batch[0]['rankings'])
+            deadline = time.time() + self.batchWindow
+            while size < self.maxBatchSize:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self.pending.get(timeout = remaining)
+                except Queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request['rankings'])
+            self.evaluateBatch(batch)
+
+    def evaluateBatch(self, batch):
+        """Evaluates the rankings of all requests of a batch with the union of their measures - if that fails, every
+        request is evaluated on its own, so only the requests that fail by themselves get the error
+
+        Parameters
+        ----------
+        batch : List type
+            The queued requests
+        """
+        measureNames = []
+        rankings = []
+        for request in batch:
+            measureNames.extend(name for name in request['measureNames'] if name not in measureNames)
+            rankings.extend(request['rankings'])
+        try:
+            results = self.evaluator.evaluateRankings(rankings, measureNames)
+        except Exception as error: # Report the failure to the waiting requests instead of losing the batching thread
+            if len(batch) > 1:
+                for request in batch:
+                    self.evaluateBatch([request])
+                return
+            batch[0]['error'] = error
+            batch[0]['done'].set()
+            return
+
+        start = 0
+        for request in batch:
+            end = start + len(request['rankings'])
+            request['result'] = [dict((name, measures[name]) for name in request['measureNames']) for measures in results[start:end]]
+            start = end
+            request['done'].set()
+
+class EvaluationRequestHandler(BaseHTTPRequestHandler):
+    """Handles POST /evaluate with a JSON body such as
+    {"measures": ["P@10", "AP"], "rankings": [{"query": 1, "documents": [9090, 6850]}]}
+    and answers {"results": [{"P@10": 0.2, "AP": 0.333}]}, one entry per ranking in request order.
+    "measures" is optional and defaults to the columns of All.eval.
+    """
+
+    def do_POST(self):
+        if self.path != '/evaluate':
+            self.sendJSON(404, {'error': 'Unknown path {}'.format(self.path)})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.getheader('Content-Length', 0))))
+            measureNames, rankings = self.parseRequest(body)
+        except ValueError as error:
+            self.sendJSON(400, {'error': str(error)})
+            return
+        try:
+            results = self.server.batcher.submit(rankings, measureNames)
+        except Exception as error:
+            self.sendJSON(500, {'error': str(error)})
+            return
+        self.sendJSON(200, {'results': results})
+
+    def parseRequest(self, body):
+        """Validates a request body
+
+        Parameters
+        ----------
+        body : Dictionary type
+            The decoded JSON body
+
+        Returns
+        -------
+        measureNames : List of strings
+            The requested measures
+        rankings : List type
+            (queryID, list of document IDs) pairs
+
+        Raises
+        ------
+        ValueError
+            If the body is malformed, a measure is unknown, a ranking repeats a document or a query has no relevant documents
+        """
+        if not isinstance(body, dict) or not isinstance(body.get('rankings'), list):
+            raise ValueError('The body must be an object with a "rankings" list')
+        measureNames = [str(name) for name in body.get('measures', defaultMeasures)]
+        for name in measureNames:
+            parseMeasureName(name)
+        rankings = []
+        for ranking in body['rankings']:
+            if not isinstance(ranking, dict) or not isinstance(ranking.get('documents'), list):
+                raise ValueError('Every ranking needs a "query" and a "documents" list')
+            queryID = ranking.get('query')
+            documentIDs = ranking['documents']
+            if not isInt32(queryID) or not all(isInt32(documentID) for documentID in documentIDs):
+                raise ValueError('Query and document IDs must be integers between {} and {}'.format(int32Limits.min, int32Limits.max))
+            if len(set(documentIDs)) != len(documentIDs): # A document retrieved twice would be credited twice
+                raise ValueError('The ranking of query {} contains a document more than once'.format(queryID))
+            if not self.server.evaluator.hasQuery(queryID):
+                raise ValueError('No relevant documents for query {}'.format(queryID))
+            rankings.append((queryID, documentIDs))
+        return measureNames, rankings
+
+    def sendJSON(self, status, content):
+        """Sends a JSON response
+
+        Parameters
+        ----------
+        status : Integer type
+            The HTTP status code
+        content : Dictionary type
+            The response body
+        """
+        body = json.dumps(content)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Keep the console quiet at hundreds of requests per second
+
+def isInt32(value):
+    """Checks whether a decoded JSON value is an integer that an int32 ID can hold
+
+    Parameters
+    ----------
+    value : Any type
+        The decoded value
+
+    Returns
+    -------
+    valid : Boolean type
+        True for integers in the int32 range - False for other values, including booleans, floats and strings
+    """
+    return isinstance(value, (int, long)) and not isinstance(value, bool) and int32Limits.min <= value <= int32Limits.max
+
+if __name__ == '__main__':
+    main()
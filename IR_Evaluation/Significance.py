@@ -0,0 +1,260 @@
+"""Significance.py : Module that tests whether the differences between systems' per query measures are significant"""
+from collections import OrderedDict
+import numpy as np
+import multiprocessing
+import math
+
+differenceMatrix = np.zeros((0, 0)) # Matrix (queries x pairs) of per query differences, read by the worker processes of compareAllPairs
+
+def compareAllPairs(systemVectors, permutations = 10000, bootstrapSamples = 10000, confidence = 0.95, seed = 0, processes = 1):
+    """Runs the paired t-test, the permutation test and the bootstrap for every pair of systems
+
+    All pairs are tested together: the differences of every pair form the columns of one matrix, and each batch of
+    random sign flips or resamples is applied to all of them with a single matrix product.
+
+    Parameters
+    ----------
+    systemVectors : Dictionary type
+        Dictionary where key = systemID and value = list of per query values, all in the same query order
+    permutations : Integer type
+        Number of random sign flips of the permutation test
+    bootstrapSamples : Integer type
+        Number of resamples of the bootstrap
+    confidence : Float type
+        Confidence level of the bootstrap interval
+    seed : Integer type
+        Seed of the random numbers - every group of pairs draws the same flips and resamples, so results do not depend on processes
+    processes : Integer type
+        Number of worker processes the pairs are spread over
+
+    Returns
+    -------
+    comparisons : List type
+        One Dictionary per pair (A before B in systemVectors order) with keys 'systemA', 'systemB', 'meanDifference',
+        't', 'pTTest', 'pPermutation', 'confidenceLow' and 'confidenceHigh'
+    """
+    global differenceMatrix
+
+    systemIDs = list(systemVectors.keys())
+    vectors = [np.asarray(systemVectors[systemID], dtype = np.float64) for systemID in systemIDs]
+    pairs = [(first, second) for first in range(len(systemIDs)) for second in range(first + 1, len(systemIDs))]
+    differenceMatrix = np.column_stack([vectors[first] - vectors[second] for first, second in pairs]) if pairs else np.zeros((0, 0))
+
+    groupSize = int(math.ceil(len(pairs) / float(max(processes, 1)))) or 1
+    tasks = [(start, min(start + groupSize, len(pairs)), permutations, bootstrapSamples, confidence, seed) for start in range(0, len(pairs), groupSize)]
+    if processes > 1 and len(tasks) > 1:
+        # Workers are forked after differenceMatrix is set, so they read the parent's copy instead of receiving it pickled
+        pool = multiprocessing.Pool(processes)
+        try:
+            groupResults = pool.map(comparePairGroup, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        groupResults = map(comparePairGroup, tasks)
+
+    comparisons = []
+    for (start, end, _, _, _, _), results in zip(tasks, groupResults):
+        for column in range(end - start):
+            first, second = pairs[start + column]
+            comparison = OrderedDict()
+            comparison['systemA'] = systemIDs[first]
+            comparison['systemB'] = systemIDs[second]
+            for name, values in results.iteritems():
+                comparison[name] = values[column]
+            comparisons.append(comparison)
+    return comparisons
+
+def comparePairGroup(task):
+    """Runs all tests for a group of pairs - also used as a worker task
+
+    Parameters
+    ----------
+    task : Tuple type
+        (first pair column, end pair column (exclusive), permutations, bootstrap samples, confidence, seed)
+
+    Returns
+    -------
+    results : Dictionary type
+        Dictionary where key = test result name (see compareAllPairs) and value = array with one value per pair
+    """
+    global differenceMatrix
+
+    start, end, permutations, bootstrapSamples, confidence, seed = task
+    differences = differenceMatrix[:, start:end]
+    results = OrderedDict()
+    results['meanDifference'] = differences.mean(axis = 0)
+    results['t'], results['pTTest'] = pairedTTest(differences)
+    results['pPermutation'] = permutationTest(differences, permutations, np.random.RandomState(seed))
+    results['confidenceLow'], results['confidenceHigh'] = bootstrapConfidenceInterval(differences, bootstrapSamples, confidence, np.random.RandomState(seed + 1))
+    return results
+
+def pairedTTest(differences):
+    """Two sided paired t-test of every column of differences
+
+    Parameters
+    ----------
+    differences : Numpy array type
+        Matrix (queries x pairs) of per query differences between the first and the second system of each pair
+
+    Returns
+    -------
+    t : Numpy array type
+        The t statistic of every pair
+    p : Numpy array type
+        The two sided p-value of every pair
+    """
+    differences = np.asarray(differences, dtype = np.float64)
+    n = differences.shape[0]
+    t = np.zeros(differences.shape[1])
+    p = np.ones(differences.shape[1])
+    if n < 2:
+        return t, p
+    degreesOfFreedom = n - 1
+    means = differences.mean(axis = 0)
+    standardErrors = differences.std(axis = 0, ddof = 1) / math.sqrt(n)
+    for column, (mean, standardError) in enumerate(zip(means, standardErrors)):
+        if standardError == 0: # Every difference is the same
+            if mean != 0:
+                t[column], p[column] = math.copysign(float('inf'), mean), 0.0
+            continue
+        t[column] = mean / standardError
+        p[column] = regularizedIncompleteBeta(degreesOfFreedom / 2.0, 0.5, degreesOfFreedom / (degreesOfFreedom + t[column] ** 2))
+    return t, p
+
+def permutationTest(differences, permutations = 10000, randomState = None, batchSize = 1000):
+    """Two sided paired randomization test of every column of differences - randomly swaps the systems' values of each
+    query by flipping the sign of its difference, with a batch of flips applied to all pairs as one matrix product
+
+    Parameters
+    ----------
+    differences : Numpy array type
+        Matrix (queries x pairs) of per query differences between the first and the second system of each pair
+    permutations : Integer type
+        Number of random sign flips
+    randomState : RandomState type
+        Source of the random numbers
+    batchSize : Integer type
+        Number of sign flips drawn at a time - bounds memory to batchSize x queries
+
+    Returns
+    -------
+    p : Numpy array type
+        The p-value of every pair, (1 + flips with an absolute mean difference at least the observed one) / (1 + permutations)
+    """
+    if randomState is None:
+        randomState = np.random.RandomState()
+    differences = np.asarray(differences, dtype = np.float64)
+    n = differences.shape[0]
+    observed = np.abs(differences.mean(axis = 0))
+    threshold = observed - 1e-12 * np.maximum(1.0, observed) # Flips that reproduce the observed difference must not lose to rounding
+
+    atLeastObserved = np.zeros(differences.shape[1], dtype = np.int64)
+    for start in range(0, permutations, batchSize):
+        count = min(batchSize, permutations - start)
+        bits = np.unpackbits(np.frombuffer(randomState.bytes(count * ((n + 7) // 8)), dtype = np.uint8)).reshape(count, -1)[:, :n]
+        signs = bits * 2.0 - 1.0
+        atLeastObserved += (np.abs(signs.dot(differences)) / n >= threshold).sum(axis = 0)
+    return (atLeastObserved + 1.0) / (permutations + 1.0)
+
+def bootstrapConfidenceInterval(differences, samples = 10000, confidence = 0.95, randomState = None, batchSize = 1000):
+    """Percentile bootstrap confidence interval of the mean difference of every column of differences, resampling
+    queries with replacement - a batch of resamples is turned into query counts and applied to all pairs as one matrix product
+
+    Parameters
+    ----------
+    differences : Numpy array type
+        Matrix (queries x pairs) of per query differences between the first and the second system of each pair
+    samples : Integer type
+        Number of resamples
+    confidence : Float type
+        Confidence level, e.g. 0.95
+    randomState : RandomState type
+        Source of the random numbers
+    batchSize : Integer type
+        Number of resamples drawn at a time - bounds memory to batchSize x queries
+
+    Returns
+    -------
+    low : Numpy array type
+        Lower bound of the mean difference of every pair
+    high : Numpy array type
+        Upper bound of the mean difference of every pair
+    """
+    if randomState is None:
+        randomState = np.random.RandomState()
+    differences = np.asarray(differences, dtype = np.float64)
+    n = differences.shape[0]
+
+    means = np.empty((samples, differences.shape[1]), dtype = np.float64)
+    for start in range(0, samples, batchSize):
+        count = min(batchSize, samples - start)
+        picks = randomState.randint(0, n, size = (count, n)) + (np.arange(count) * n)[:, np.newaxis]
+        counts = np.bincount(picks.ravel(), minlength = count * n).reshape(count, n)
+        means[start:start + count] = counts.dot(differences) / float(n)
+    tail = (1.0 - confidence) / 2.0 * 100.0
+    low, high = np.percentile(means, [tail, 100.0 - tail], axis = 0)
+    return low, high
+
+def regularizedIncompleteBeta(a, b, x):
+    """Regularized incomplete beta function I_x(a, b), evaluated with its continued fraction
+
+    Parameters
+    ----------
+    a : Float type
+        First shape parameter
+    b : Float type
+        Second shape parameter
+    x : Float type
+        Upper limit of the integral, between 0 and 1
+
+    Returns
+    -------
+    value : Float type
+        I_x(a, b)
+    """
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1.0 - x))
+    if x < (a + 1.0) / (a + b + 2.0): # The continued fraction converges quickly here
+        return front * betaContinuedFraction(a, b, x) / a
+    return 1.0 - front * betaContinuedFraction(b, a, 1.0 - x) / b
+
+def betaContinuedFraction(a, b, x, iterations = 300, epsilon = 3e-16):
+    """Evaluates the continued fraction of the incomplete beta function with the modified Lentz method
+
+    Parameters
+    ----------
+    a : Float type
+        First shape parameter
+    b : Float type
+        Second shape parameter
+    x : Float type
+        Upper limit of the integral
+    iterations : Integer type
+        Maximum number of terms
+    epsilon : Float type
+        Relative precision at which to stop
+
+    Returns
+    -------
+    value : Float type
+        The value of the continued fraction
+    """
+    tiny = 1e-300
+    c = 1.0
+    d = 1.0 - (a + b) * x / (a + 1.0)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    result = d
+    for m in range(1, iterations + 1):
+        for numerator in (m * (b - m) * x / ((a + 2 * m - 1.0) * (a + 2 * m)), -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1.0))):
+            d = 1.0 + numerator * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            result *= d * c
+        if abs(d * c - 1.0) < epsilon:
+            break
+    return result
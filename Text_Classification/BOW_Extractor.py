@@ -1,17 +1,52 @@
 """BOW_Extractor.py : Module that extracts the BOW features from the training files"""
 from collections import OrderedDict
+from itertools import islice
+from Tokenizer import Tokenizer
+import multiprocessing
+import numpy as np
+import argparse
 import os
-import re
 
 uniqueTermIdDictionary = OrderedDict() # Dictionary that stores terms and corresponding ID
 idEnumerator = 1 # Global enumerator to assign IDs to terms
+corpusTweetIDs = [] # Tweet IDs of the tokenized corpus, in file order
+corpusCategories = [] # Categories of the tokenized corpus, in file order
+corpusTermIDs = [] # Sorted term IDs of every tweet of the tokenized corpus, concatenated
+corpusOffsets = [0] # Start of every tweet's term IDs in corpusTermIDs, followed by the end of the last tweet
+tweetTokenizer = Tokenizer() # Removes links and splits on any non alphabetical character
 
 def main():
-    importTweetFileToDictionary('tweets/Tweets.14cat.train') # Import training file and preprocess
-    exportUniqueTerms('tc_out/feats.dic') # Export unique terms and corresponding IDs to file
+    parser = argparse.ArgumentParser(description = 'Extracts the BOW features from the tweet train file')
+    parser.add_argument('--processes', type = int, default = 1, help = 'Number of worker processes collecting the terms of shards of the file (default: %(default)s)')
+    parser.add_argument('--update', metavar = 'PATH', help = 'Tweet file of new labelled tweets - only these are read, and their new terms are appended to the existing tc_out/feats.dic')
+    arguments = parser.parse_args()
+
+    if arguments.update:
+        updateFingerprint = getUpdateFingerprint(arguments.update)
+        if updateFingerprint in loadAppliedUpdates('tc_out/feats.dic.updates'):
+            print('{} was already added to tc_out/feats.dic - skipped'.format(arguments.update))
+            return
+        importUniqueTerms('tc_out/feats.dic') # Continue the IDs of the existing dictionary
+        firstNewTermID = idEnumerator
+        pathToTweetFile = arguments.update
+    else:
+        pathToTweetFile = 'tweets/Tweets.14cat.train'
+    if arguments.processes > 1:
+        importTweetFileToDictionaryParallel(pathToTweetFile, arguments.processes) # Same IDs as the sequential pass
+    else:
+        importTweetFileToDictionary(pathToTweetFile) # Import training file and preprocess
+    if arguments.update:
+        appendUniqueTerms('tc_out/feats.dic', firstNewTermID) # Existing terms keep their IDs
+        recordAppliedUpdate('tc_out/feats.dic.updates', updateFingerprint)
+        exportCorpus('tc_out/feats.update.corpus.npz', pathToTweetFile) # Tokenized new tweets for the converter
+    else:
+        exportUniqueTerms('tc_out/feats.dic') # Export unique terms and corresponding IDs to file
+        resetAppliedUpdates('tc_out/feats.dic.updates') # The rebuilt dictionary holds the training file only
+        exportCorpus('tc_out/feats.corpus.npz', pathToTweetFile) # Export the tokenized training file so the converter does not tokenize it again
 
 def importTweetFileToDictionary(pathToFile):
-    """Reads tweets train file and saves unique terms in dictionary structure with unique IDs
+    """Reads tweets train file and saves unique terms in dictionary structure with unique IDs - the term IDs of every
+    tweet's features are kept as the tokenized corpus
 
     Parameters
     ----------
@@ -26,43 +61,214 @@ def importTweetFileToDictionary(pathToFile):
             if line == "\n": # Skip empty lines
                 continue
             tweetID, tweet, category = line.strip().split("\t")
-            tweet = removeLinks(tweet) # Remove links from text
-            termsList = filter(None, tokenize(tweet))
+            tweetTermIDs = set() # IDs of the tweet's terms, i.e. its features
+            termsList = tweetTokenizer.tokenize(tweet) # Remove links from text and split
             for term in termsList:
                 if term not in uniqueTermIdDictionary:
                     uniqueTermIdDictionary[term] = idEnumerator
                     idEnumerator += 1
+                tweetTermIDs.add(uniqueTermIdDictionary[term])
+            addCorpusEntry(tweetID, category, tweetTermIDs)
+
+def importTweetFileToDictionaryParallel(pathToFile, processes):
+    """Builds the same dictionary and tokenized corpus as importTweetFileToDictionary with worker processes: each worker
+    collects the terms of a byte range of the file in first occurrence order, and the ranges are merged in file order,
+    so every term gets the ID of its first occurrence in the whole file
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the file
+    processes : Integer type
+        Number of worker processes
+    """
+    global uniqueTermIdDictionary
+    global idEnumerator
+    global corpusTweetIDs
+    global corpusCategories
+    global corpusTermIDs
+    global corpusOffsets
+
+    tasks = [(pathToFile, start, end) for start, end in getFileShards(pathToFile, processes * 4)]
+    pool = multiprocessing.Pool(processes)
+    try:
+        for terms, tweetIDs, categories, offsets, localTermIDs in pool.imap(collectShardVocabulary, tasks): # In file order
+            globalIDs = np.empty(len(terms), dtype = np.int64) # Global ID of every local term ID
+            for localID, term in enumerate(terms):
+                if term not in uniqueTermIdDictionary:
+                    uniqueTermIdDictionary[term] = idEnumerator
+                    idEnumerator += 1
+                globalIDs[localID] = uniqueTermIdDictionary[term]
+            termIDs = globalIDs[localTermIDs]
+            tweetIndices = np.repeat(np.arange(len(tweetIDs)), np.diff(offsets))
+            termIDs = termIDs[np.lexsort((termIDs, tweetIndices))] # Sort the IDs within each tweet
+            corpusTweetIDs.extend(tweetIDs)
+            corpusCategories.extend(categories)
+            corpusOffsets.extend((offsets[1:] + len(corpusTermIDs)).tolist())
+            corpusTermIDs.extend(termIDs.tolist())
+    finally:
+        pool.close()
+        pool.join()
 
-def tokenize(string):
-    """Splits parameter 'string' on spaces and returns a list of the tokens.
+def collectShardVocabulary(task):
+    """Collects the terms of a byte range of a tweet file - worker task of importTweetFileToDictionaryParallel
 
     Parameters
     ----------
-    string : String type
-        A sentence to be split
+    task : Tuple type
+        (path leading to the file, first byte, end byte (exclusive)), where both bytes are at the start of a line
 
     Returns
     -------
-    tokens : List of strings
-        A list containing all tokens
+    terms : List of strings
+        The distinct terms of the range in first occurrence order - the local ID of a term is its index
+    tweetIDs : List of strings
+        The IDs of the range's tweets
+    categories : List of strings
+        The categories of the range's tweets
+    offsets : Numpy array type
+        Start of every tweet's local term IDs in localTermIDs, followed by the end of the last tweet
+    localTermIDs : Numpy array type
+        The distinct local term IDs of every tweet, concatenated
     """
-    # return re.split(r'\s+', string) # Tokenize on any whitespace character - baseline tokenization
-    return re.split(r'\W+', string) # Tokenize on any non alphabetical character
+    pathToFile, start, end = task
+    localDictionary = {} # Dictionary where key = term and value = local ID
+    terms = []
+    tweetIDs = []
+    categories = []
+    offsets = [0]
+    localTermIDs = []
+    with open(pathToFile, 'r') as file:
+        file.seek(start)
+        position = start
+        while position < end:
+            line = file.readline()
+            if not line:
+                break
+            position += len(line)
+            if line == "\n": # Skip empty lines
+                continue
+            tweetID, tweet, category = line.strip().split("\t")
+            tweetTermIDs = set()
+            for term in tweetTokenizer.tokenize(tweet):
+                if term not in localDictionary:
+                    localDictionary[term] = len(terms)
+                    terms.append(term)
+                tweetTermIDs.add(localDictionary[term])
+            tweetIDs.append(tweetID)
+            categories.append(category)
+            localTermIDs.extend(tweetTermIDs)
+            offsets.append(len(localTermIDs))
+    return terms, tweetIDs, categories, np.array(offsets, dtype = np.int64), np.array(localTermIDs, dtype = np.int64)
 
-def removeLinks(text):
-    """Removes links from given text - either http or https.
+def addCorpusEntry(tweetID, category, termIDs):
+    """Appends a tweet to the tokenized corpus
 
     Parameters
     ----------
-    text : String type
-        A text string which may contain links
+    tweetID : String type
+        The tweet's ID
+    category : String type
+        The tweet's category
+    termIDs : Set type
+        The IDs of the tweet's features
+    """
+    global corpusTweetIDs
+    global corpusCategories
+    global corpusTermIDs
+    global corpusOffsets
+
+    corpusTweetIDs.append(tweetID)
+    corpusCategories.append(category)
+    corpusTermIDs.extend(sorted(termIDs))
+    corpusOffsets.append(len(corpusTermIDs))
+
+def exportCorpus(pathToFile, pathToTweetFile):
+    """Exports the tokenized corpus to a binary file, stamped with the tweet file's size and modification time and the
+    number of terms in the dictionary
+
+    Parameters
+    ----------
+    pathToFile : String type
+        Path leading to the output file
+    pathToTweetFile : String type
+        Path leading to the tweet file the corpus was read from
+    """
+    global uniqueTermIdDictionary
+    global corpusTweetIDs
+    global corpusCategories
+    global corpusTermIDs
+    global corpusOffsets
+
+    path = pathToFile.rsplit('/', 1)[0]
+    if not os.path.exists(path): # Check whether the directory exists or not
+        os.makedirs(path)
+    status = os.stat(pathToTweetFile)
+    temporaryPath = '{}.{}.tmp'.format(pathToFile, os.getpid())
+    with open(temporaryPath, 'wb') as output:
+        np.savez(output, sourceSize = np.int64(status.st_size), sourceModificationTime = np.float64(status.st_mtime),
+                 dictionarySize = np.int64(len(uniqueTermIdDictionary)), tweetIDs = np.array(corpusTweetIDs, dtype = np.str_),
+                 categories = np.array(corpusCategories, dtype = np.str_), offsets = np.array(corpusOffsets, dtype = np.int64),
+                 termIDs = np.array(corpusTermIDs, dtype = np.int32))
+    os.rename(temporaryPath, pathToFile) # The converter never reads a partially written corpus
+
+def loadCorpus(pathToFile, pathToTweetFile, dictionarySize):
+    """Loads the tokenized corpus of a tweet file
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the corpus
+    pathToTweetFile : String type
+        The path leading to the tweet file
+    dictionarySize : Integer type
+        Number of terms in the loaded dictionary
 
     Returns
     -------
-    withoutLinks : String type
-        The given string without any links
+    corpus : Dictionary type
+        Dictionary with the 'tweetIDs', 'categories', 'offsets' and 'termIDs' arrays, None if there is no corpus or it
+        does not match the tweet file or the dictionary
     """
-    return re.sub(r'https?:\/\/[^\s]+', '', text)
+    if not os.path.exists(pathToFile):
+        return None
+    status = os.stat(pathToTweetFile)
+    try:
+        with np.load(pathToFile) as corpus:
+            if corpus['sourceSize'] != status.st_size or corpus['sourceModificationTime'] != status.st_mtime or corpus['dictionarySize'] != dictionarySize:
+                return None
+            return dict((name, corpus[name]) for name in ('tweetIDs', 'categories', 'offsets', 'termIDs'))
+    except (IOError, ValueError, KeyError): # Unreadable or incomplete corpus - tokenize the tweet file again
+        return None
+
+def getFileShards(pathToFile, shardCount):
+    """Splits a file into byte ranges of about the same size that start and end at line boundaries
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the file
+    shardCount : Integer type
+        Number of ranges to aim for - fewer are returned for small files
+
+    Returns
+    -------
+    shards : List type
+        (first byte, end byte (exclusive)) pairs in file order, covering the whole file
+    """
+    size = os.path.getsize(pathToFile)
+    boundaries = [0]
+    with open(pathToFile, 'rb') as file:
+        for index in range(1, shardCount):
+            offset = size * index // shardCount
+            if offset <= boundaries[-1]:
+                continue
+            file.seek(offset - 1)
+            file.readline() # Move to the start of the next line, or stay if offset already is one
+            if file.tell() > boundaries[-1] and file.tell() < size:
+                boundaries.append(file.tell())
+    boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries[:-1], boundaries[1:]) if start < end]
 
 def exportUniqueTerms(pathToFile):
     """Exports the unique terms with their id to a file
@@ -82,4 +288,99 @@ def exportUniqueTerms(pathToFile):
         for term, id in uniqueTermIdDictionary.iteritems():
             output.write('{}\t{}\n'.format(term, id))
 
-main()
+def appendUniqueTerms(pathToFile, firstTermID):
+    """Appends the terms added to the dictionary since it was imported with their id to a file, so the file is
+    extended rather than rewritten
+
+    Parameters
+    ----------
+    pathToFile : String type
+        Path leading to the dictionary file
+    firstTermID : Integer type
+        ID of the first term that is not in the file yet
+    """
+    global uniqueTermIdDictionary
+
+    with open(pathToFile, 'a') as output:
+        for term, id in islice(uniqueTermIdDictionary.iteritems(), firstTermID - 1, None): # IDs follow insertion order
+            output.write('{}\t{}\n'.format(term, id))
+
+def importUniqueTerms(pathToFile):
+    """Reads the unique terms with their id from a file written by exportUniqueTerms, so that new terms continue its IDs
+
+    Parameters
+    ----------
+    pathToFile : String type
+        Path leading to the dictionary file
+    """
+    global uniqueTermIdDictionary
+    global idEnumerator
+
+    with open(pathToFile, 'r') as file:
+        for line in file:
+            if line == "\n": # Skip empty lines
+                continue
+            term, id = line.strip().split("\t")
+            uniqueTermIdDictionary[term] = int(id)
+            idEnumerator = max(idEnumerator, int(id) + 1)
+
+def getUpdateFingerprint(pathToFile):
+    """Identifies a file of new tweets by its path, size and modification time, so that it is applied only once
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the file
+
+    Returns
+    -------
+    fingerprint : String type
+        "path\tsize\tmodification time"
+    """
+    status = os.stat(pathToFile)
+    return '{}\t{}\t{!r}'.format(os.path.abspath(pathToFile), status.st_size, status.st_mtime)
+
+def loadAppliedUpdates(pathToFile):
+    """Reads the fingerprints of the update files that were already applied to an output
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the record, e.g. tc_out/feats.dic.updates
+
+    Returns
+    -------
+    fingerprints : Set type
+        The fingerprints, empty if there is no record
+    """
+    if not os.path.exists(pathToFile):
+        return set()
+    with open(pathToFile, 'r') as file:
+        return set(line.rstrip('\n') for line in file if line != "\n")
+
+def recordAppliedUpdate(pathToFile, fingerprint):
+    """Appends the fingerprint of an update file to the record of an output, once the update was applied to it
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the record
+    fingerprint : String type
+        The fingerprint, as returned by getUpdateFingerprint
+    """
+    with open(pathToFile, 'a') as output:
+        output.write(fingerprint + '\n')
+
+def resetAppliedUpdates(pathToFile):
+    """Removes the record of an output that was rebuilt from scratch
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the record
+    """
+    if os.path.exists(pathToFile):
+        os.remove(pathToFile)
+
+if __name__ == '__main__':
+    main()
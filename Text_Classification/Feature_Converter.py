@@ -1,17 +1,63 @@
 """Feature_Converter.py : Module that converts both tweet train & test files to feats files"""
-from BOW_Extractor import tokenize, removeLinks
+from BOW_Extractor import tweetTokenizer, loadCorpus, getFileShards, getUpdateFingerprint, loadAppliedUpdates, recordAppliedUpdate, resetAppliedUpdates
+from Sparse_Features import createSparseFeatures, saveSparseFeatures, SparseFeatures
 from collections import OrderedDict
+import multiprocessing
+import argparse
+import shutil
+import gzip
+import numpy as np
+import zlib
+import os
 
 uniqueTermIdDictionary = OrderedDict() # Dictionary that stores terms and corresponding ID
 classDictionary = OrderedDict() # Dictionary that stores class name and corresponding ID
+featureHasher = None # FeatureHasher that replaces the dictionary in hashing mode
 
 def main():
-    importFeatsToDictionary('tc_out/feats.dic') # Import terms and corresponding IDs created in BOW_Extraction module
+    parser = argparse.ArgumentParser(description = 'Converts the tweet train and test files to feats files')
+    parser.add_argument('--processes', type = int, default = 1, help = 'Number of worker processes converting shards of a tweet file (default: %(default)s)')
+    parser.add_argument('--gzip', action = 'store_true', help = 'Write gzip compressed feats files (feats.train.gz, feats.test.gz)')
+    parser.add_argument('--csr', action = 'store_true', help = 'Write binary CSR matrices (tc_out/feats.train.csr/, tc_out/feats.test.csr/) instead of feats files')
+    parser.add_argument('--hash-bits', type = int, default = 0, help = 'Hash terms to 2^bits feature IDs instead of using feats.dic - 0 disables hashing (default: %(default)s)')
+    parser.add_argument('--hash-functions', type = int, default = 1, help = 'Number of features every term sets in hashing mode - more make colliding terms distinguishable (default: %(default)s)')
+    parser.add_argument('--hash-sample-rate', type = float, default = 0.0, help = 'Fraction of terms whose feature IDs are written to tc_out/feats.hash.sample in hashing mode (default: %(default)s)')
+    parser.add_argument('--update', metavar = 'PATH', help = 'Tweet file of new labelled tweets, after "BOW_Extractor.py --update" - only these are converted, to tc_out/feats.update, and appended to tc_out/feats.train')
+    arguments = parser.parse_args()
+    if arguments.update and arguments.csr:
+        parser.error('--update appends to feats files and cannot be combined with --csr')
+
+    global featureHasher
+
+    suffix = '.gz' if arguments.gzip else ''
+    if arguments.update:
+        updateFingerprint = getUpdateFingerprint(arguments.update)
+        if updateFingerprint in loadAppliedUpdates('tc_out/feats.train' + suffix + '.updates'):
+            print('{} was already appended to tc_out/feats.train{} - skipped'.format(arguments.update, suffix))
+            return
+        if arguments.hash_bits == 0 and updateFingerprint not in loadAppliedUpdates('tc_out/feats.dic.updates'):
+            parser.error('run "BOW_Extractor.py --update {}" first, so feats.dic holds its terms'.format(arguments.update))
+    if arguments.hash_bits > 0:
+        featureHasher = FeatureHasher(arguments.hash_bits, arguments.hash_functions, arguments.hash_sample_rate) # No dictionary needed
+    else:
+        importFeatsToDictionary('tc_out/feats.dic') # Import terms and corresponding IDs created in BOW_Extraction module
     importCategoriesToDictionary('files/classIDs.txt') # Import classes and corresponding IDs
-    convertTweetEntries('tweets/Tweets.14cat.train', 'tc_out/feats.train')
-    convertTweetEntries('tweets/Tweets.14cat.test', 'tc_out/feats.test')
+    if arguments.csr:
+        saveSparseFeatures('tc_out/feats.train.csr', convertTweetFileToSparseFeatures('tweets/Tweets.14cat.train', 'tc_out/feats.corpus.npz'))
+        saveSparseFeatures('tc_out/feats.test.csr', convertTweetFileToSparseFeatures('tweets/Tweets.14cat.test'))
+    elif arguments.update:
+        convertTweetEntries(arguments.update, 'tc_out/feats.update', 'tc_out/feats.update.corpus.npz', arguments.processes, arguments.gzip)
+        appendFeatsFile('tc_out/feats.update' + suffix, 'tc_out/feats.train' + suffix)
+        recordAppliedUpdate('tc_out/feats.train' + suffix + '.updates', updateFingerprint) # A repeated run must not append the tweets again
+        convertTweetEntries('tweets/Tweets.14cat.test', 'tc_out/feats.test', processes = arguments.processes, compress = arguments.gzip) # New terms may occur in test tweets
+    else:
+        convertTweetEntries('tweets/Tweets.14cat.train', 'tc_out/feats.train', 'tc_out/feats.corpus.npz', arguments.processes, arguments.gzip) # The extractor already tokenized the training file
+        resetAppliedUpdates('tc_out/feats.train' + suffix + '.updates')
+        convertTweetEntries('tweets/Tweets.14cat.test', 'tc_out/feats.test', processes = arguments.processes, compress = arguments.gzip)
+    if featureHasher is not None and arguments.hash_sample_rate > 0:
+        featureHasher.exportSample('tc_out/feats.hash.sample')
 
-def convertTweetEntries(pathToInputFile, pathToOutputFile):
+def convertTweetEntries(pathToInputFile, pathToOutputFile, pathToCorpus = None, processes = 1, compress = False):
     """Reads file and converts it to termID format - feats file
 
     Parameters
@@ -19,33 +65,368 @@ def convertTweetEntries(pathToInputFile, pathToOutputFile):
     pathToInputFile : String type
         The path leading to the input file
     pathToOutputFile : String type
-        The path leading to the output file
+        The path leading to the output file - '.gz' is appended when compressing
+    pathToCorpus : String type
+        The path leading to the tokenized corpus of the input file - used instead of tokenizing the input file if it
+        matches the input file and the dictionary
+    processes : Integer type
+        Number of worker processes - with more than one, byte ranges of the input file are converted in parallel
+    compress : Boolean type
+        Whether to write a gzip compressed feats file
+    """
+    global uniqueTermIdDictionary
+    global classDictionary
+    global featureHasher
+
+    if compress and not pathToOutputFile.endswith('.gz'):
+        pathToOutputFile += '.gz'
+    if pathToCorpus is not None and featureHasher is None: # The corpus holds dictionary IDs
+        corpus = loadCorpus(pathToCorpus, pathToInputFile, len(uniqueTermIdDictionary))
+        if corpus is not None:
+            convertCorpusEntries(corpus, pathToOutputFile, compress)
+            return
+    if processes > 1:
+        convertTweetShards(pathToInputFile, pathToOutputFile, processes, compress)
+        return
+
+    with open(pathToInputFile, 'r') as file, FeatureWriter(pathToOutputFile, compress) as output:
+        for line in file:
+            convertTweetLine(line, output)
+
+def convertTweetLine(line, output):
+    """Converts a line of a tweet file to termID format and writes it to the feats file
+
+    Parameters
+    ----------
+    line : String type
+        The line, "tweetID\ttweet\tcategory"
+    output : FeatureWriter type
+        The feats file
+    """
+    entry = getTweetEntry(line)
+    if entry is not None:
+        output.writeEntry(*entry)
+
+def getTweetEntry(line):
+    """Converts a line of a tweet file to its class ID, term IDs and tweet ID
+
+    Parameters
+    ----------
+    line : String type
+        The line, "tweetID\ttweet\tcategory"
+
+    Returns
+    -------
+    entry : Tuple type
+        (class ID, sorted term IDs, tweet ID), None for an empty line
+    """
+    global uniqueTermIdDictionary
+    global classDictionary
+    global featureHasher
+
+    if line == "\n": # Skip empty lines
+        return None
+    tempSet = set() # Set used to: 1) keep unique IDs within entry 2) sort IDs in ascending order
+    tweetID, tweet, category = line.strip().split("\t")
+    termList = tweetTokenizer.tokenize(tweet) # Remove links and split
+    if featureHasher is not None:
+        return classDictionary[category], sorted(featureHasher.getTermIDs(termList)), tweetID
+    for term in termList:
+        if term not in uniqueTermIdDictionary: # If the term is not in the dictionary neglect it (test set)
+            continue
+        else:
+            tempSet.add(int(uniqueTermIdDictionary[term])) # Otherwise, if it is in the term list add its corresponding ID
+    return classDictionary[category], sorted(tempSet), tweetID
+
+def convertTweetFileToSparseFeatures(pathToInputFile, pathToCorpus = None):
+    """Converts a tweet file to a CSR feature matrix in memory, without writing a feats file
+
+    Parameters
+    ----------
+    pathToInputFile : String type
+        The path leading to the input file
+    pathToCorpus : String type
+        The path leading to the tokenized corpus of the input file - used instead of tokenizing the input file if it
+        matches the input file and the dictionary
+
+    Returns
+    -------
+    features : SparseFeatures type
+        The feature matrix, with the same rows as the feats file of the input file
     """
     global uniqueTermIdDictionary
     global classDictionary
+    global featureHasher
 
-    output = open(pathToOutputFile, 'w')
+    if pathToCorpus is not None and featureHasher is None:
+        corpus = loadCorpus(pathToCorpus, pathToInputFile, len(uniqueTermIdDictionary))
+        if corpus is not None: # The corpus already is a CSR matrix
+            labels = np.array([int(classDictionary[category]) for category in corpus['categories'].tolist()], dtype = np.int32)
+            return SparseFeatures(labels, corpus['offsets'], corpus['termIDs'], corpus['tweetIDs'].tolist())
 
+    labels = []
+    rows = []
+    tweetIDs = []
     with open(pathToInputFile, 'r') as file:
         for line in file:
-            if line == "\n": # Skip empty lines
-                continue
-            tempString = "" # String used to generate the format for the classifier
-            tempSet = set() # Set used to: 1) keep unique IDs within entry 2) sort IDs in ascending order
-            tweetID, tweet, category = line.strip().split("\t")
-            tweet = removeLinks(tweet) # Remove links
-            termList = filter(None, tokenize(tweet))
-            for term in termList:
-                if term not in uniqueTermIdDictionary: # If the term is not in the dictionary neglect it (test set)
-                    continue
-                else:
-                    tempSet.add(int(uniqueTermIdDictionary[term])) # Otherwise, if it is in the term list add its corresponding ID
-            sortedSet = sorted(tempSet)
-            output.write(str(classDictionary[category]) + ' ')
-            for termID in sortedSet:
-                output.write(str(termID) + ':1 ') # ':1 '.join(map(str, aset)) - second way though it needs a small tweak to print well
-            output.write('#' + str(tweetID) + '\n')
-    output.close()
+            entry = getTweetEntry(line)
+            if entry is not None:
+                labels.append(int(entry[0]))
+                rows.append(entry[1])
+                tweetIDs.append(entry[2])
+    return createSparseFeatures(labels, rows, tweetIDs)
+
+def convertTweetShards(pathToInputFile, pathToOutputFile, processes, compress = False):
+    """Converts byte ranges of a tweet file in worker processes and concatenates their feats in file order
+
+    Parameters
+    ----------
+    pathToInputFile : String type
+        The path leading to the input file
+    pathToOutputFile : String type
+        The path leading to the output file
+    processes : Integer type
+        Number of worker processes
+    compress : Boolean type
+        Whether to write a gzip compressed feats file - every worker compresses its own part, and the concatenated
+        parts form a valid multi member gzip file
+    """
+    shards = getFileShards(pathToInputFile, processes * 4) # More shards than processes, so a slow shard does not leave the others idle
+    tasks = [(pathToInputFile, '{}.{}.part{}'.format(pathToOutputFile, os.getpid(), index), start, end, compress) for index, (start, end) in enumerate(shards)]
+    # Workers are forked after the dictionaries are loaded, so each reads the parent's copy instead of receiving it pickled
+    pool = multiprocessing.Pool(processes)
+    try:
+        samples = pool.map(convertTweetShard, tasks)
+    finally:
+        pool.close()
+        pool.join()
+    if featureHasher is not None: # Terms were hashed in the workers - collect their samples in file order
+        for sample in samples:
+            featureHasher.mergeSample(sample)
+
+    with open(pathToOutputFile, 'wb') as output:
+        for _, pathToPart, _, _, _ in tasks:
+            with open(pathToPart, 'rb') as part:
+                shutil.copyfileobj(part, output, 1 << 20)
+            os.remove(pathToPart)
+
+def convertTweetShard(task):
+    """Converts the lines of a byte range of a tweet file to a partial feats file - worker task
+
+    Parameters
+    ----------
+    task : Tuple type
+        (path leading to the input file, path leading to the partial output file, first byte, end byte (exclusive),
+        whether to compress), where both bytes are at the start of a line
+
+    Returns
+    -------
+    sample : List type
+        (term, feature IDs) pairs sampled by the feature hasher in this range, None without hashing
+    """
+    global featureHasher
+
+    pathToInputFile, pathToPart, start, end, compress = task
+    if featureHasher is not None:
+        featureHasher.sample = OrderedDict() # A worker converts several ranges - sample each one on its own
+    with open(pathToInputFile, 'r') as file, FeatureWriter(pathToPart, compress) as output:
+        file.seek(start)
+        position = start
+        while position < end:
+            line = file.readline()
+            if not line:
+                break
+            position += len(line)
+            convertTweetLine(line, output)
+    return featureHasher.sample.items() if featureHasher is not None else None
+
+def convertCorpusEntries(corpus, pathToOutputFile, compress = False):
+    """Converts a tokenized corpus to termID format - feats file
+
+    Parameters
+    ----------
+    corpus : Dictionary type
+        The corpus arrays, as returned by loadCorpus
+    pathToOutputFile : String type
+        The path leading to the output file
+    compress : Boolean type
+        Whether to write a gzip compressed feats file
+    """
+    global classDictionary
+
+    offsets = corpus['offsets'].tolist()
+    termIDs = corpus['termIDs'].tolist()
+    with FeatureWriter(pathToOutputFile, compress) as output:
+        for index, (tweetID, category) in enumerate(zip(corpus['tweetIDs'].tolist(), corpus['categories'].tolist())):
+            output.writeEntry(classDictionary[category], termIDs[offsets[index]:offsets[index + 1]], tweetID) # Already unique and sorted
+
+def appendFeatsFile(pathToPart, pathToFile):
+    """Appends a feats file to another one - gzip compressed files can be appended as they are, since concatenated gzip
+    files form a valid multi member gzip file
+
+    Parameters
+    ----------
+    pathToPart : String type
+        The path leading to the feats file to append
+    pathToFile : String type
+        The path leading to the feats file that is extended
+    """
+    with open(pathToPart, 'rb') as part, open(pathToFile, 'ab') as output:
+        shutil.copyfileobj(part, output, 1 << 20)
+
+class FeatureWriter(object):
+    """Writes feats file lines ("label termID:1 termID:1 #tweetID") - every line is formatted in one operation and lines
+    are written to the file in large batches
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the feats file
+    compress : Boolean type
+        Whether to gzip compress the file
+    batchLines : Integer type
+        Number of lines collected before they are written with a single write
+    """
+
+    def __init__(self, pathToFile, compress = False, batchLines = 8192):
+        if compress:
+            self.file = gzip.open(pathToFile, 'wb', 6) # Level 6 compresses almost as well as 9 in a fraction of the time
+        else:
+            self.file = open(pathToFile, 'wb')
+        self.batchLines = batchLines
+        self.lines = []
+
+    def writeEntry(self, label, termIDs, tweetID):
+        """Adds the line of a tweet
+
+        Parameters
+        ----------
+        label : String type
+            The class ID
+        termIDs : List type
+            The tweet's term IDs in ascending order
+        tweetID : String type
+            The tweet's ID
+        """
+        if len(termIDs):
+            self.lines.append(label + ' ' + ':1 '.join(map(str, termIDs)) + ':1 #' + tweetID + '\n')
+        else:
+            self.lines.append(label + ' #' + tweetID + '\n')
+        if len(self.lines) >= self.batchLines:
+            self.flush()
+
+    def flush(self):
+        """Writes the collected lines to the file"""
+        self.file.write(''.join(self.lines))
+        self.lines = []
+
+    def close(self):
+        """Writes the remaining lines and closes the file"""
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        self.close()
+
+class FeatureHasher(object):
+    """Maps terms to feature IDs with hashes instead of a dictionary (hashing trick), so conversion needs no vocabulary
+    and constant memory. Terms whose hashes collide share features; with several hash functions every term sets several
+    features, so two terms only become indistinguishable if all their features collide. The i-th feature is
+    CRC32 + i * Adler-32 (double hashing) - two independent hashes, as CRC32s that only differ in their start value
+    collide for the same terms.
+
+    Parameters
+    ----------
+    bits : Integer type
+        The feature IDs are 1 to 2^bits
+    hashFunctions : Integer type
+        Number of features every term sets
+    sampleRate : Float type
+        Fraction of terms, chosen by their hash, whose feature IDs are kept for debugging
+    maxSampledTerms : Integer type
+        Maximum number of kept terms, bounding the memory of the sample
+    """
+
+    def __init__(self, bits = 20, hashFunctions = 1, sampleRate = 0.0, maxSampledTerms = 100000):
+        self.size = 1 << bits
+        self.hashFunctions = hashFunctions
+        self.sampleThreshold = int(sampleRate * (1 << 32))
+        self.maxSampledTerms = maxSampledTerms
+        self.sample = OrderedDict() # Dictionary where key = sampled term and value = its feature IDs
+
+    def getTermIDs(self, terms):
+        """Returns the feature IDs of terms
+
+        Parameters
+        ----------
+        terms : List of strings
+            The terms
+
+        Returns
+        -------
+        termIDs : Set type
+            The distinct feature IDs of the terms
+
+        Examples
+        --------
+        "nowplaying" and "social_4_u" collide under CRC32 with any start value, but not under double hashing
+
+        >>> hasher = FeatureHasher(20, 2)
+        >>> sorted(hasher.getTermIDs(['nowplaying'])), sorted(hasher.getTermIDs(['social_4_u']))
+        ([158495, 943830], [92857, 943830])
+        """
+        termIDs = set()
+        for term in terms:
+            featureIDs = self.getFeatureIDs(term)
+            termIDs.update(featureIDs)
+            if self.sampleThreshold and (zlib.crc32(term, 0x5bd1e995) & 0xffffffff) < self.sampleThreshold and term not in self.sample and len(self.sample) < self.maxSampledTerms:
+                self.sample[term] = featureIDs
+        return termIDs
+
+    def getFeatureIDs(self, term):
+        """Returns the feature IDs of a term, one per hash function
+
+        Parameters
+        ----------
+        term : String type
+            The term
+
+        Returns
+        -------
+        featureIDs : List type
+            The feature IDs, starting at 1
+        """
+        size = self.size
+        first = zlib.crc32(term) & 0xffffffff
+        step = zlib.adler32(term) & 0xffffffff | 1 # Odd, so the features of a term are distinct while hashFunctions <= size
+        return [(first + index * step) % size + 1 for index in range(self.hashFunctions)]
+
+    def mergeSample(self, sample):
+        """Adds terms sampled by another FeatureHasher with the same settings, e.g. in a worker process
+
+        Parameters
+        ----------
+        sample : List type
+            (term, feature IDs) pairs in the order they were sampled
+        """
+        for term, termIDs in sample:
+            if term not in self.sample and len(self.sample) < self.maxSampledTerms:
+                self.sample[term] = termIDs
+
+    def exportSample(self, pathToFile):
+        """Exports the sampled terms with their feature IDs to a file, in the format of feats.dic
+
+        Parameters
+        ----------
+        pathToFile : String type
+            Path leading to the output file
+        """
+        with open(pathToFile, 'w') as output:
+            for term, termIDs in self.sample.iteritems():
+                output.write('{}\t{}\n'.format(term, ','.join(map(str, termIDs))))
 
 def importFeatsToDictionary(pathToFile):
     """Reads the features dictionary from a file
@@ -78,4 +459,5 @@ def importCategoriesToDictionary(pathToFile):
             category, catID = line.strip().split('\t')
             classDictionary[category] = catID
 
-main()
+if __name__ == '__main__':
+    main()
@@ -2,23 +2,44 @@
 from collections import OrderedDict
 from nltk.stem import PorterStemmer # Porter Stemmer
 from nltk.corpus import wordnet as wn
+import nltk
+from multiprocessing.pool import ThreadPool
+import cPickle as pickle
 import lxml.html
-from urllib2 import urlopen
+import threading
+import urlparse
+import httplib
+import socket
+import sys
 import os
-import re
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # Tokenizer.py is shared with the baseline classifier
+from Tokenizer import Tokenizer, linkPattern
+from BOW_Extractor import uniqueTermIdDictionary, corpusTweetIDs, corpusCategories, corpusTermIDs, corpusOffsets, addCorpusEntry, exportCorpus, loadCorpus # The corpus helpers fill and export these shared objects in place
 
-uniqueTermIdDictionary = OrderedDict() # Dictionary that stores terms and corresponding ID
 idEnumerator = 1 # Global enumerator to assign IDs to terms
 stopwords = set() # Set with stopwords - O(1) search
+tweetTokenizer = Tokenizer(lowercase = True, splitUnderscores = True) # Removes links, lower cases, splits and leaves out stopwords once loadStopwords ran
+titleTokenizer = Tokenizer(lowercase = True, splitUnderscores = True) # Lower cases and splits link titles - their stopwords are left to the callers
 porter = PorterStemmer()
+linkTitleCache = None # Dictionary where key = link and value = webpage title (None if unavailable), loaded from linkTitleCacheFile on first use
+linkTitleCacheFile = 'tc_out_improved/.link_titles' # Persistent title cache shared by the extractor, the converter and later runs
+linkFetchThreads = 32 # Number of links fetched concurrently
+linkFetchTimeout = 1 # Seconds to wait for a webpage
+linkFetchFailures = set() # Links that could not be reached in this run - not cached, so later runs fetch them again
+connections = threading.local() # Per thread Dictionary where key = (scheme, host) and value = open keep-alive connection
+wordCacheFile = 'tc_out_improved/.word_cache' # Persistent stem and synonym caches shared by the extractor, the converter and later runs
 
 def main():
     loadStopwords()
+    loadWordCaches(wordCacheFile) # Stems and synonyms of earlier runs
     importTweetFileToDictionary('tweets/Tweets.14cat.train') # Import training file and preprocess
     exportUniqueTerms('tc_out_improved/feats1.dic') # Export unique terms and corresponding IDs to file
+    exportCorpus('tc_out_improved/feats1.corpus.npz', 'tweets/Tweets.14cat.train') # Export the tokenized training file so the converter does not tokenize it again
+    saveWordCaches(wordCacheFile)
 
 def importTweetFileToDictionary(pathToFile):
-    """Reads tweets train file and saves unique terms in dictionary structure with unique IDs
+    """Reads tweets train file and saves unique terms in dictionary structure with unique IDs - the term IDs of every
+    tweet's features are kept as the tokenized corpus
 
     Parameters
     ----------
@@ -28,66 +49,140 @@ def importTweetFileToDictionary(pathToFile):
     global uniqueTermIdDictionary
     global idEnumerator
 
+    prefetchLinkTitles(pathToFile) # Fetch the titles of all links of the file in one concurrent batch
     with open(pathToFile, 'r') as file:
         for line in file:
             if line == "\n": # Skip empty lines
                 continue
             tweetID, tweet, category = line.strip().split("\t")
+            tweetTermIDs = set() # IDs of the tweet's features - stemmed link title and tweet terms that are not stopwords
             for link in getLinks(tweet):
-                linkTerms = filter(None, getLinkTitleTerms(link))
+                linkTerms = getLinkTitleTerms(link)
                 for term in linkTerms:
                     if isNotAStopword(term) and term is not '' or term is not ' ':
                         stemmedTerm = stemWord(term)
                         if stemmedTerm not in uniqueTermIdDictionary:
                             uniqueTermIdDictionary[stemmedTerm] = idEnumerator
                             idEnumerator += 1
-            tweet = removeLinks(tweet).lower() # Remove links from text and lower case
-            termsList = filter(None, tokenize(tweet))
+                        if isNotAStopword(term): # The converter only keeps link title terms that are not stopwords
+                            tweetTermIDs.add(uniqueTermIdDictionary[stemmedTerm])
+            termsList = tweetTokenizer.tokenize(tweet) # Remove links from text, lower case, split and leave out stopwords
             for term in termsList:
-                if isNotAStopword(term):
-                    stemmedTerm = stemWord(term)
-                    if stemmedTerm not in uniqueTermIdDictionary:
-                        uniqueTermIdDictionary[stemmedTerm] = idEnumerator
+                stemmedTerm = stemWord(term)
+                if stemmedTerm not in uniqueTermIdDictionary:
+                    uniqueTermIdDictionary[stemmedTerm] = idEnumerator
+                    idEnumerator += 1
+                tweetTermIDs.add(uniqueTermIdDictionary[stemmedTerm])
+                synonyms = getSynonyms(term)
+                for synonym in synonyms:
+                    if synonym not in uniqueTermIdDictionary:
+                        uniqueTermIdDictionary[synonym] = idEnumerator
                         idEnumerator += 1
-                    synonyms = getSynonyms(term)
-                    for synonym in synonyms:
-                        if synonym not in uniqueTermIdDictionary:
-                            uniqueTermIdDictionary[synonym] = idEnumerator
-                            idEnumerator += 1
+            addCorpusEntry(tweetID, category, tweetTermIDs)
 
-def tokenize(string):
-    """Splits parameter 'string' on spaces and returns a list of the tokens.
+def getLinkTitleTerms(link):
+    """Returns title list from given link - either http or https. The title is read from the link title cache and only
+    fetched if the link was never seen before.
 
     Parameters
     ----------
-    string : String type
-        A sentence to be split
+    link : String type
+        The website
 
     Returns
     -------
-    tokens : List of strings
-        A list containing all tokens
+    titleTerms : List type
+        Terms of webpage's titles
     """
-    # return re.split(r'\s+', string) # Tokenize on any whitespace character - baseline tokenization
-    return re.split(r'_|\W+', string) # Tokenize on any non alphabetical character
+    global linkTitleCache
 
-def removeLinks(text):
-    """Removes links from given text - either http or https.
+    if linkTitleCache is None:
+        linkTitleCache = loadLinkTitleCache(linkTitleCacheFile)
+    if link in linkFetchFailures:
+        return []
+    if link not in linkTitleCache:
+        titleText, reached = fetchLinkTitle(link)
+        if not reached:
+            linkFetchFailures.add(link)
+            return []
+        linkTitleCache[link] = titleText
+    titleText = linkTitleCache[link]
+    if titleText is None:
+        return []
+    return titleTokenizer.tokenize(titleText)
+
+def prefetchLinkTitles(pathToFile):
+    """Fetches the titles of all distinct links of a tweet file that are not cached yet, concurrently, and saves them to the
+    cache - links that could not be reached are left out of it, so the next run tries them again
 
     Parameters
     ----------
-    text : String type
-        A text string which may contain links
+    pathToFile : String type
+        The path leading to the tweet file
+    """
+    global linkTitleCache
+
+    if linkTitleCache is None:
+        linkTitleCache = loadLinkTitleCache(linkTitleCacheFile)
+    links = OrderedDict()
+    with open(pathToFile, 'r') as file:
+        for line in file:
+            if line == "\n": # Skip empty lines
+                continue
+            for link in getLinks(line.strip().split("\t")[1]):
+                if link not in linkTitleCache and link not in linkFetchFailures:
+                    links[link] = None
+    if not links:
+        return
+    pool = ThreadPool(min(linkFetchThreads, len(links)))
+    try:
+        results = pool.map(fetchLinkTitle, links.keys())
+    finally:
+        pool.close()
+        pool.join()
+    for link, (titleText, reached) in zip(links.keys(), results):
+        if reached:
+            linkTitleCache[link] = titleText
+        else:
+            linkFetchFailures.add(link)
+    saveLinkTitleCache(linkTitleCacheFile, linkTitleCache)
+
+def fetchLinkTitle(link, redirects = 5):
+    """Downloads a webpage and returns its title - connections are kept alive and reused by the same thread
+
+    Parameters
+    ----------
+    link : String type
+        The website
+    redirects : Integer type
+        Maximum number of redirects to follow, e.g. from a t.co short link to the actual page
 
     Returns
     -------
-    withoutLinks : String type
-        The given string without any links
+    titleText : String type
+        The webpage's title, None if the page could not be fetched or has no title
+    reached : Boolean type
+        Whether the server answered - False for network errors and timeouts, which may not happen again and so must
+        not be cached
     """
-    return re.sub(r'https?:\/\/[^\s]+', '', text)
+    try:
+        for _ in range(redirects + 1):
+            status, location, body = requestPage(link)
+            if status in (301, 302, 303, 307, 308) and location:
+                link = urlparse.urljoin(link, location)
+                continue
+            if status != 200:
+                return None, True
+            title = lxml.html.fromstring(body).find('.//title')
+            return (title.text if title is not None else None), True
+    except (httplib.HTTPException, socket.error): # DNS errors, timeouts, refused or reset connections
+        return None, False
+    except Exception: # Any malformed or non html page simply contributes no terms
+        return None, True
+    return None, True
 
-def getLinkTitleTerms(link):
-    """Returns title list from given link - either http or https.
+def requestPage(link):
+    """Sends a GET request for a link over the calling thread's connection to its host
 
     Parameters
     ----------
@@ -96,17 +191,77 @@ def getLinkTitleTerms(link):
 
     Returns
     -------
-    titleTerms : List type
-        Terms of webpage's titles
+    status : Integer type
+        The HTTP status code
+    location : String type
+        The Location header of a redirect, otherwise None
+    body : String type
+        The response body
+    """
+    parts = urlparse.urlsplit(link)
+    if parts.scheme not in ('http', 'https'):
+        raise ValueError('Unsupported link {}'.format(link))
+    path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+    if not hasattr(connections, 'open'):
+        connections.open = {}
+    key = (parts.scheme, parts.netloc)
+    for attempt in range(2): # A kept alive connection may have been closed by the server - retry once on a new one
+        reused = key in connections.open
+        if not reused:
+            connectionClass = httplib.HTTPSConnection if parts.scheme == 'https' else httplib.HTTPConnection
+            connections.open[key] = connectionClass(parts.netloc, timeout = linkFetchTimeout)
+        connection = connections.open[key]
+        try:
+            connection.request('GET', path, headers = {'Connection': 'keep-alive', 'User-Agent': 'Mozilla/5.0'})
+            response = connection.getresponse()
+            body = response.read()
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            del connections.open[key]
+            if reused and attempt == 0:
+                continue
+            raise
+        if response.getheader('Connection', '').lower() == 'close':
+            connection.close()
+            del connections.open[key]
+        return response.status, response.getheader('Location'), body
+
+def loadLinkTitleCache(pathToFile):
+    """Loads the persistent link title cache
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the cache
+
+    Returns
+    -------
+    linkTitles : Dictionary type
+        Dictionary where key = link and value = webpage title, empty if there is no readable cache
     """
-    titleTerms = []
     try:
-        tree = lxml.html.parse(urlopen(link, timeout = 1))
-        titleText = tree.find('.//title').text
-        titleTerms = tokenize(titleText.lower())
-        return titleTerms
-    except:
-        return []
+        with open(pathToFile, 'rb') as file:
+            return pickle.load(file)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        return {}
+
+def saveLinkTitleCache(pathToFile, linkTitles):
+    """Saves the persistent link title cache
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the cache
+    linkTitles : Dictionary type
+        Dictionary where key = link and value = webpage title
+    """
+    path = pathToFile.rsplit('/', 1)[0]
+    if not os.path.exists(path): # Check whether the directory exists or not
+        os.makedirs(path)
+    temporaryPath = '{}.{}.tmp'.format(pathToFile, os.getpid())
+    with open(temporaryPath, 'wb') as output:
+        pickle.dump(linkTitles, output, pickle.HIGHEST_PROTOCOL)
+    os.rename(temporaryPath, pathToFile) # Other stages never see a partially written cache
 
 def getLinks(text):
     """Returns links from given text - either http or https.
@@ -121,9 +276,7 @@ def getLinks(text):
     links : List type
         The links within the text
     """
-    p = re.compile(r'https?:\/\/[^\s]+')
-    links = p.findall(text)
-    return links
+    return linkPattern.findall(text)
 
 def exportUniqueTerms(pathToFile):
     """Exports the unique terms with their id to a file
@@ -143,8 +296,63 @@ def exportUniqueTerms(pathToFile):
         for term, id in uniqueTermIdDictionary.iteritems():
             output.write('{}\t{}\n'.format(term, id))
 
+class LRUCache(object):
+    """Bounded memoization of a function of one argument that evicts the least recently used results first
+
+    Parameters
+    ----------
+    function : Function type
+        The function whose results are cached
+    maxSize : Integer type
+        Maximum number of cached results
+    """
+
+    def __init__(self, function, maxSize):
+        self.function = function
+        self.maxSize = maxSize
+        self.entries = OrderedDict() # Least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        """Returns the function's result for key, computing it only if it is not cached
+
+        Parameters
+        ----------
+        key : String type
+            The function's argument
+
+        Returns
+        -------
+        value : Object type
+            The function's result
+        """
+        entries = self.entries
+        if key in entries:
+            self.hits += 1
+            value = entries.pop(key)
+            entries[key] = value # Move to the most recently used end
+            return value
+        self.misses += 1
+        value = self.function(key)
+        entries[key] = value
+        if len(entries) > self.maxSize:
+            entries.popitem(last = False)
+        return value
+
+    def hitRate(self):
+        """Returns the fraction of lookups answered from the cache
+
+        Returns
+        -------
+        hitRate : Float type
+            hits / (hits + misses), 0 if there were no lookups
+        """
+        lookups = self.hits + self.misses
+        return self.hits / float(lookups) if lookups else 0.0
+
 def stemWord(word):
-    """Stems the given word using the Porter Stemmer library
+    """Stems the given word using the Porter Stemmer library - memoized in stemCache
 
     Parameters
     ----------
@@ -156,8 +364,8 @@ def stemWord(word):
     stemmedWord : String type
         The stemmed version of the given word
     """
-    global porter
-    return porter.stem(word)
+    global stemCache
+    return stemCache.lookup(word)
 
 def isNotAStopword(word):
     """Determines whether a word is a stopword
@@ -181,11 +389,13 @@ def loadStopwords():
     """Loads all stopword terms from file and saves them to a set structure
     """
     global stopwords
+    global tweetTokenizer
     with open('files/stopwords.txt') as stopWordFile:
         stopwords = set(stopWordFile.read().splitlines())
+    tweetTokenizer.stopwords = stopwords
 
 def getSynonyms(term):
-    """Finds word synonyms and returns them
+    """Finds word synonyms and returns them - memoized in synonymCache
 
     Parameters
     ----------
@@ -197,10 +407,88 @@ def getSynonyms(term):
     synonyms : List type
         List of synonyms
     """
+    global synonymCache
+    return list(synonymCache.lookup(term))
+
+def findSynonyms(term):
+    """Looks the synonyms of a word up in WordNet
+
+    Parameters
+    ----------
+    term : String type
+        A word whose synonyms will be obtained
+
+    Returns
+    -------
+    synonyms : Tuple type
+        The synonyms
+    """
     tempSet = set()
     for synset in wn.synsets(term):
         for word in synset.lemma_names():
             tempSet.add(word)
-    return list(tempSet)
+    return tuple(tempSet)
+
+def loadWordCaches(pathToFile):
+    """Fills stemCache and synonymCache with the results saved by an earlier run of the same NLTK version
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the cache
+    """
+    global stemCache
+    global synonymCache
+
+    try:
+        with open(pathToFile, 'rb') as file:
+            saved = pickle.load(file)
+    except (IOError, EOFError, pickle.UnpicklingError): # No readable cache - start empty
+        return
+    if saved.get('version') != nltk.__version__: # Stems and WordNet data may differ between versions
+        return
+    for cache, name in ((stemCache, 'stems'), (synonymCache, 'synonyms')):
+        for key, value in saved[name][-cache.maxSize:]:
+            cache.entries[key] = value
+
+def saveWordCaches(pathToFile):
+    """Saves the contents of stemCache and synonymCache, least recently used first
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the cache
+    """
+    global stemCache
+    global synonymCache
+
+    path = pathToFile.rsplit('/', 1)[0]
+    if not os.path.exists(path): # Check whether the directory exists or not
+        os.makedirs(path)
+    saved = {'version': nltk.__version__, 'stems': stemCache.entries.items(), 'synonyms': synonymCache.entries.items()}
+    temporaryPath = '{}.{}.tmp'.format(pathToFile, os.getpid())
+    with open(temporaryPath, 'wb') as output:
+        pickle.dump(saved, output, pickle.HIGHEST_PROTOCOL)
+    os.rename(temporaryPath, pathToFile) # Other stages never see a partially written cache
+
+def getWordCacheStatistics():
+    """Returns the hit counters of stemCache and synonymCache
+
+    Returns
+    -------
+    statistics : Dictionary type
+        Dictionary where key = 'stems' or 'synonyms' and value = Dictionary with the 'hits', 'misses', 'hitRate' and 'size' of the cache
+    """
+    global stemCache
+    global synonymCache
+
+    statistics = OrderedDict()
+    for cache, name in ((stemCache, 'stems'), (synonymCache, 'synonyms')):
+        statistics[name] = {'hits': cache.hits, 'misses': cache.misses, 'hitRate': cache.hitRate(), 'size': len(cache.entries)}
+    return statistics
+
+stemCache = LRUCache(porter.stem, 200000) # Memoized stems, see stemWord
+synonymCache = LRUCache(findSynonyms, 100000) # Memoized WordNet synonyms, see getSynonyms
 
-main()
+if __name__ == '__main__':
+    main()
@@ -1,39 +1,56 @@
 """Classifier_Evaluator.py : Module that evaluates the classifier"""
 from collections import OrderedDict
+from itertools import izip_longest
+import numpy as np
+import argparse
 import os
 
-distinctClasses = set() # Set containg the unique class IDs
-testClassesList = [] # List containing all the test file class ids
-predictionClassesList = [] # List containing all the prediction file class ids
+distinctClasses = np.zeros(0, dtype = np.int64) # Array containg the unique class IDs in ascending order
+testClassesList = np.zeros(0, dtype = np.int64) # Array containing all the test file class ids
+predictionClassesList = np.zeros(0, dtype = np.int64) # Array containing all the prediction file class ids
+confusionMatrix = np.zeros((0, 0), dtype = np.int64) # Matrix where row = test class and column = predicted class, both in distinctClasses order
 classMeasures = OrderedDict() # Dictionary where key = class ID and value = (precision, recall, f1) triplet
 
 def main():
     global testClassesList, predictionClassesList, distinctClasses, classMeasures
 
-    testClassesList = importClasses('tc_out_improved/feats1.test')
-    # predictionClassesList = importClasses('svm_windows/pred.out')
-    predictionClassesList = importClasses('svm_linux_improved/pred_improved.out')
+    parser = argparse.ArgumentParser(description = 'Evaluates the predictions of the classifier against the test file and writes tc_out_improved/Eval_improved.txt')
+    parser.add_argument('--streaming', action = 'store_true', help = 'Read both files a chunk of lines at a time, so memory does not grow with their length')
+    parser.add_argument('--chunk-lines', type = int, default = 100000, help = 'Number of lines per chunk in streaming mode (default: %(default)s)')
+    parser.add_argument('--micro-f1', action = 'store_true', help = 'Also write the micro averaged F1 after the Macro-F1 line')
+    arguments = parser.parse_args()
 
+    if arguments.streaming:
+        # calculateStreamingConfusionMatrix('tc_out_improved/feats1.test', 'svm_windows/pred.out', arguments.chunk_lines)
+        calculateStreamingConfusionMatrix('tc_out_improved/feats1.test', 'svm_linux_improved/pred_improved.out', arguments.chunk_lines)
+    else:
+        testClassesList = importClasses('tc_out_improved/feats1.test')
+        # predictionClassesList = importClasses('svm_windows/pred.out')
+        predictionClassesList = importClasses('svm_linux_improved/pred_improved.out')
+        calculateConfusionMatrix()
     calculateClassMeasures()
-    exportResults("tc_out_improved/Eval_improved.txt")
-    # matrix = calculateConfusionMatrix()
-    # printConfusionMatrix(matrix)
+    exportResults("tc_out_improved/Eval_improved.txt", arguments.micro_f1)
+    # printConfusionMatrix(confusionMatrix)
 
-def exportResults(pathToOutputFile):
+def exportResults(pathToOutputFile, includeMicroFMeasure = False):
     """Exports results to a specified file
 
     Parameters
     ----------
     pathToOutputFile : String type
         The path leading to the output file
+    includeMicroFMeasure : Boolean type
+        Whether to write a Micro-F1 line after the Macro-F1 line
     """
     global testClassesList, predictionClassesList, distinctClasses, classMeasures
 
     with open(pathToOutputFile, 'w') as output:
         output.write('Accuracy = {:.3f}\n'.format(calculateSystemAccuracy()))
         output.write('Macro-F1 = {:.3f}\n'.format(calculateSystemFMeasure()))
+        if includeMicroFMeasure:
+            output.write('Micro-F1 = {:.3f}\n'.format(calculateSystemMicroFMeasure()))
         output.write('Results per class:\n')
-        for classID in distinctClasses:
+        for classID in distinctClasses.tolist():
             output.write('{}: P={:.3f} R={:.3f} F={:.3f}\n'.format(classID, classMeasures[classID][0], classMeasures[classID][1], classMeasures[classID][2]))
 
 def printConfusionMatrix(matrix):
@@ -41,36 +58,107 @@ def printConfusionMatrix(matrix):
 
     Parameters
     ----------
-    matrix : Dictionary type
-        Confusion matrix - Dictionary of Dictionaries and frequencies
+    matrix : Numpy array type
+        Confusion matrix - rows are test classes and columns predicted classes
     """
-    for key, value in matrix.iteritems():
-        for k, v in value.iteritems():
-            print("{:>3}".format(str(v))),
+    for row in matrix.tolist():
+        for value in row:
+            print("{:>3}".format(str(value))),
         print("")
 
 def calculateConfusionMatrix():
-    """Calculates the confusion matrix of the classifier
+    """Calculates the confusion matrix of the classifier with a single bincount over (test class, predicted class)
+    pairs and sets distinctClasses to the classes seen in either list
 
     Returns
     -------
-    confusionMatrix : Dictionary type
-        Confusion matrix - Dictionary of Dictionaries and frequencies
+    confusionMatrix : Numpy array type
+        Confusion matrix - rows are test classes and columns predicted classes, both in distinctClasses order
     """
-    global distinctClasses, testClassesList, predictionClassesList
+    global distinctClasses, testClassesList, predictionClassesList, confusionMatrix
 
-    confusionMatrix = OrderedDict()
-    for index in distinctClasses:
-        confusionMatrix[index] = OrderedDict()
-        for innerIndex in distinctClasses:
-            confusionMatrix[index][innerIndex] = 0
+    if len(testClassesList) != len(predictionClassesList):
+        raise ValueError('{} test classes but {} predictions'.format(len(testClassesList), len(predictionClassesList)))
+    distinctClasses, confusionMatrix = accumulateConfusionMatrix(np.zeros(0, dtype = np.int64), np.zeros((0, 0), dtype = np.int64), testClassesList, predictionClassesList)
+    return confusionMatrix
+
+def calculateStreamingConfusionMatrix(pathToTestFile, pathToPredictionFile, chunkLines = 100000):
+    """Calculates the confusion matrix of the classifier reading both files a chunk of lines at a time, so only one chunk
+    of each file is held in memory, and sets distinctClasses to the classes seen in either file
+
+    Lines of both files are matched in order. Where both lines carry a "#tweetID" trailer the tweet IDs have to be the
+    same, so predictions that do not belong to the test file are detected. svm_multiclass_classify writes no trailers,
+    in which case only the number of lines can be checked and a warning is printed.
 
-    totalPredictions = len(testClassesList)
-    for i in range(0, totalPredictions):
-        confusionMatrix[int(testClassesList[i])][int(predictionClassesList[i])] += 1
+    Parameters
+    ----------
+    pathToTestFile : String type
+        The path leading to the test feats file
+    pathToPredictionFile : String type
+        The path leading to the prediction file
+    chunkLines : Integer type
+        Number of lines per chunk
 
+    Returns
+    -------
+    confusionMatrix : Numpy array type
+        Confusion matrix - rows are test classes and columns predicted classes, both in distinctClasses order
+    """
+    global distinctClasses, confusionMatrix
+
+    classes = np.zeros(0, dtype = np.int64)
+    matrix = np.zeros((0, 0), dtype = np.int64)
+    lineCount = 0 # Lines matched in the chunks before
+    uncheckedCount = 0 # Lines whose test tweet ID could not be compared, as the prediction has none
+    for testChunk, predictionChunk in izip_longest(readClassChunks(pathToTestFile, chunkLines), readClassChunks(pathToPredictionFile, chunkLines)):
+        if testChunk is None or predictionChunk is None or len(testChunk[0]) != len(predictionChunk[0]):
+            raise ValueError('{} and {} have a different number of lines'.format(pathToTestFile, pathToPredictionFile))
+        for i, (testTweetID, predictionTweetID) in enumerate(zip(testChunk[1], predictionChunk[1])):
+            if testTweetID is not None and predictionTweetID is None:
+                uncheckedCount += 1
+            elif testTweetID is not None and testTweetID != predictionTweetID:
+                raise ValueError('Line {}: test tweet {} but prediction for tweet {}'.format(lineCount + i + 1, testTweetID, predictionTweetID))
+        classes, matrix = accumulateConfusionMatrix(classes, matrix, testChunk[0], predictionChunk[0])
+        lineCount += len(testChunk[0])
+    if uncheckedCount:
+        print('Warning: {} of {} lines of {} have no #tweetID, so only their number was checked against {}'.format(uncheckedCount, lineCount, pathToPredictionFile, pathToTestFile))
+
+    distinctClasses, confusionMatrix = classes, matrix
     return confusionMatrix
 
+def accumulateConfusionMatrix(classes, matrix, testClasses, predictionClasses):
+    """Adds (test class, predicted class) pairs to a confusion matrix, growing it by the classes it has not seen yet
+
+    Parameters
+    ----------
+    classes : Numpy array type
+        The class IDs of the matrix's rows and columns, in ascending order
+    matrix : Numpy array type
+        Confusion matrix - rows are test classes and columns predicted classes
+    testClasses : Numpy array type
+        The test class IDs
+    predictionClasses : Numpy array type
+        The predicted class IDs, one per test class ID
+
+    Returns
+    -------
+    classes : Numpy array type
+        The class IDs of the updated matrix, in ascending order
+    matrix : Numpy array type
+        The updated confusion matrix
+    """
+    newClasses = np.union1d(classes, np.concatenate((testClasses, predictionClasses)))
+    classCount = len(newClasses)
+    if classCount != len(classes): # Copy the counts so far into a matrix with rows and columns for the new classes
+        positions = np.searchsorted(newClasses, classes)
+        grownMatrix = np.zeros((classCount, classCount), dtype = np.int64)
+        grownMatrix[np.ix_(positions, positions)] = matrix
+        matrix = grownMatrix
+    testIndices = np.searchsorted(newClasses, testClasses)
+    predictionIndices = np.searchsorted(newClasses, predictionClasses)
+    matrix = matrix + np.bincount(testIndices * classCount + predictionIndices, minlength = classCount * classCount).reshape(classCount, classCount)
+    return newClasses, matrix
+
 def calculateSystemFMeasure():
     """Calculates system's F1 Measure
 
@@ -86,28 +174,55 @@ def calculateSystemFMeasure():
 
     return float(F1Sum) / float(len(classMeasures))
 
+def calculateSystemMicroFMeasure():
+    """Calculates system's micro averaged F1 Measure - the F1 of the true positives, false positives and false negatives
+    of all classes together
+
+    Returns
+    -------
+    F1 : Float type
+        The micro F1 of the classifier
+    """
+    global confusionMatrix
+    correctPredictions = float(np.trace(confusionMatrix))
+    falsePositives = float(confusionMatrix.sum() - correctPredictions) # Every wrong prediction is a false positive of one class and a false negative of another
+    return divide(2.0 * correctPredictions, 2.0 * correctPredictions + 2.0 * falsePositives)
+
 def calculateClassMeasures():
-    """Calculates precision, recall and F1 measures of the classifier for the given class
+    """Calculates precision, recall and F1 measures of the classifier for every class from the confusion matrix - a
+    measure whose denominator is zero (a class never predicted or never in the test file) is 0
+    """
+    global distinctClasses, confusionMatrix, classMeasures
+
+    correctPredictions = np.diag(confusionMatrix).astype(np.float64)
+    numberOfPredictions = confusionMatrix.sum(axis = 0).astype(np.float64) # Number of total predictions
+    classTotal = confusionMatrix.sum(axis = 1).astype(np.float64)
+
+    precision = divide(correctPredictions, numberOfPredictions)
+    recall = divide(correctPredictions, classTotal)
+    f1 = divide(2.0 * precision * recall, precision + recall)
+    classMeasures = OrderedDict()
+    for classID, classScores in zip(distinctClasses.tolist(), zip(precision.tolist(), recall.tolist(), f1.tolist())):
+        classMeasures[classID] = classScores
+
+def divide(numerators, denominators):
+    """Divides element wise, with 0 wherever the denominator is 0
+
+    Parameters
+    ----------
+    numerators : Numpy array type
+        The numerators
+    denominators : Numpy array type
+        The denominators
+
+    Returns
+    -------
+    quotients : Numpy array type
+        The quotients
     """
-    global testClassesList, predictionClassesList, classMeasures
-    correctPredictions = numberOfPredictions = classTotal = 0
-
-    totalPredictions = len(testClassesList)
-    for classID in distinctClasses:
-        correctPredictions = numberOfPredictions = classTotal = 0
-        for i in range(0, totalPredictions):
-            if int(predictionClassesList[i]) == classID:
-                numberOfPredictions += 1 # Number of total predictions
-                if testClassesList[i] == predictionClassesList[i]:
-                    correctPredictions += 1 # Number of correct predictions
-
-            if int(testClassesList[i]) == classID:
-                classTotal += 1
-
-        precision = float(correctPredictions) / float(numberOfPredictions)
-        recall = float(correctPredictions) / float(classTotal)
-        f1 = float(2 * float(precision) * float(recall)) / float(float(precision) + float(recall))
-        classMeasures[classID] = (precision, recall, f1)
+    numerators = np.asarray(numerators, dtype = np.float64)
+    denominators = np.asarray(denominators, dtype = np.float64)
+    return np.where(denominators != 0, numerators / np.where(denominators != 0, denominators, 1.0), 0.0)
 
 def calculateSystemAccuracy():
     """Calculates accuracy of classifier
@@ -117,13 +232,8 @@ def calculateSystemAccuracy():
     accuracy : Float type
         The accuracy of the classifier in terms of correctly classified IDs
     """
-    global testClassesList, predictionClassesList
-    correctPredictions = 0
-    totalPredictions = len(testClassesList)
-    for i in range(0, totalPredictions):
-        if testClassesList[i] == predictionClassesList[i]:
-            correctPredictions += 1
-    return float(correctPredictions)/float(totalPredictions)
+    global confusionMatrix
+    return divide(np.trace(confusionMatrix), confusionMatrix.sum()).item()
 
 def importClasses(pathToFile):
     """Reads classes from test file
@@ -135,19 +245,43 @@ def importClasses(pathToFile):
 
     Returns
     -------
-    classesList : List of Integers
-        The list with all class IDs
+    classesList : Numpy array type
+        The array with all class IDs
     """
-    global distinctClasses
-    classesList = []
+    with open(pathToFile, 'r') as file:
+        return np.array([line.split(None, 1)[0] for line in file if line != "\n"], dtype = np.int64) # Skip empty lines
+
+def readClassChunks(pathToFile, chunkLines = 100000):
+    """Reads the class IDs and tweet IDs of a test or prediction file a chunk of lines at a time
 
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the file
+    chunkLines : Integer type
+        Number of lines per chunk
+
+    Returns
+    -------
+    chunks : Generator type
+        (class IDs array, tweet IDs list) of every chunk of lines, in file order - the tweet ID of a line without a
+        "#tweetID" trailer is None
+    """
     with open(pathToFile, 'r') as file:
+        classes = []
+        tweetIDs = []
         for line in file:
             if line == "\n": # Skip empty lines
                 continue
-            category = line.strip().split(' ')[0]
-            classesList.append(category)
-            distinctClasses.add(int(category))
-    return classesList
+            _, separator, tweetID = line.rstrip().rpartition('#')
+            classes.append(line.split(None, 1)[0])
+            tweetIDs.append(tweetID if separator else None)
+            if len(classes) == chunkLines:
+                yield np.array(classes, dtype = np.int64), tweetIDs
+                classes = []
+                tweetIDs = []
+        if classes:
+            yield np.array(classes, dtype = np.int64), tweetIDs
 
-main()
+if __name__ == '__main__':
+    main()
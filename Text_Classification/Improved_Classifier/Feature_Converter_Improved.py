@@ -1,17 +1,20 @@
 """Feature_Converter.py : Module that converts both tweet train & test files to feats files"""
-from BOW_Extractor_Improved import tokenize, removeLinks, isNotAStopword, stemWord, getLinkTitleTerms, getLinks
+from BOW_Extractor_Improved import tweetTokenizer, isNotAStopword, stemWord, getLinkTitleTerms, getLinks, prefetchLinkTitles, loadStopwords, loadCorpus, loadWordCaches, saveWordCaches, wordCacheFile
 from collections import OrderedDict
 
 uniqueTermIdDictionary = OrderedDict() # Dictionary that stores terms and corresponding ID
 classDictionary = OrderedDict() # Dictionary that stores class name and corresponding ID
 
 def main():
+    loadStopwords()
+    loadWordCaches(wordCacheFile) # Stems of the extractor's run
     importFeatsToDictionary('tc_out_improved/feats1.dic') # Import terms and corresponding IDs created in BOW_Extraction module
     importCategoriesToDictionary('files/classIDs.txt') # Import classes and corresponding IDs
-    convertTweetEntries('tweets/Tweets.14cat.train', 'tc_out_improved/feats1.train')
+    convertTweetEntries('tweets/Tweets.14cat.train', 'tc_out_improved/feats1.train', 'tc_out_improved/feats1.corpus.npz') # The extractor already tokenized the training file
     convertTweetEntries('tweets/Tweets.14cat.test', 'tc_out_improved/feats1.test')
+    saveWordCaches(wordCacheFile)
 
-def convertTweetEntries(pathToInputFile, pathToOutputFile):
+def convertTweetEntries(pathToInputFile, pathToOutputFile, pathToCorpus = None):
     """Reads file and converts it to termID format - feats file
 
     Parameters
@@ -20,10 +23,20 @@ def convertTweetEntries(pathToInputFile, pathToOutputFile):
         The path leading to the input file
     pathToOutputFile : String type
         The path leading to the output file
+    pathToCorpus : String type
+        The path leading to the tokenized corpus of the input file - used instead of tokenizing the input file if it
+        matches the input file and the dictionary
     """
     global uniqueTermIdDictionary
     global classDictionary
 
+    if pathToCorpus is not None:
+        corpus = loadCorpus(pathToCorpus, pathToInputFile, len(uniqueTermIdDictionary))
+        if corpus is not None:
+            convertCorpusEntries(corpus, pathToOutputFile)
+            return
+
+    prefetchLinkTitles(pathToInputFile) # Fetch the titles of links not seen by the extractor in one concurrent batch
     output = open(pathToOutputFile, 'w')
 
     with open(pathToInputFile, 'r') as file:
@@ -34,21 +47,19 @@ def convertTweetEntries(pathToInputFile, pathToOutputFile):
             tempSet = set() # Set used to: 1) keep unique IDs within entry 2) sort IDs in ascending order
             tweetID, tweet, category = line.strip().split("\t")
             for link in getLinks(tweet):
-                linkTerms = filter(None, getLinkTitleTerms(link))
+                linkTerms = getLinkTitleTerms(link)
                 for term in linkTerms:
                     if isNotAStopword(term):
                         stemmedTerm = stemWord(term)
                         if stemmedTerm in uniqueTermIdDictionary:
                             tempSet.add(int(uniqueTermIdDictionary[stemmedTerm])) # Otherwise, if it is in the term list add its corresponding ID
-            tweet = removeLinks(tweet).lower() # Remove links
-            termList = filter(None, tokenize(tweet))
+            termList = tweetTokenizer.tokenize(tweet) # Remove links, lower case, split and leave out stopwords
             for term in termList:
-                if isNotAStopword(term):
-                    stemmedTerm = stemWord(term)
-                    if stemmedTerm not in uniqueTermIdDictionary: # If the term is not in the dictionary neglect it (test set)
-                        continue
-                    else:
-                        tempSet.add(int(uniqueTermIdDictionary[stemmedTerm])) # Otherwise, if it is in the term list add its corresponding ID
+                stemmedTerm = stemWord(term)
+                if stemmedTerm not in uniqueTermIdDictionary: # If the term is not in the dictionary neglect it (test set)
+                    continue
+                else:
+                    tempSet.add(int(uniqueTermIdDictionary[stemmedTerm])) # Otherwise, if it is in the term list add its corresponding ID
             sortedSet = sorted(tempSet)
             output.write(str(classDictionary[category]) + ' ')
             for termID in sortedSet:
@@ -56,6 +67,25 @@ def convertTweetEntries(pathToInputFile, pathToOutputFile):
             output.write('#' + str(tweetID) + '\n')
     output.close()
 
+def convertCorpusEntries(corpus, pathToOutputFile):
+    """Converts a tokenized corpus to termID format - feats file
+
+    Parameters
+    ----------
+    corpus : Dictionary type
+        The corpus arrays, as returned by loadCorpus
+    pathToOutputFile : String type
+        The path leading to the output file
+    """
+    global classDictionary
+
+    offsets = corpus['offsets'].tolist()
+    termIDs = corpus['termIDs'].tolist()
+    with open(pathToOutputFile, 'w') as output:
+        for index, (tweetID, category) in enumerate(zip(corpus['tweetIDs'].tolist(), corpus['categories'].tolist())):
+            tweetTermIDs = termIDs[offsets[index]:offsets[index + 1]] # Already unique and sorted
+            output.write(str(classDictionary[category]) + ' ' + ''.join(str(termID) + ':1 ' for termID in tweetTermIDs) + '#' + tweetID + '\n')
+
 def importFeatsToDictionary(pathToFile):
     """Reads the features dictionary from a file
 
@@ -87,4 +117,5 @@ def importCategoriesToDictionary(pathToFile):
             category, catID = line.strip().split('\t')
             classDictionary[category] = catID
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""Linear_Classifier.py : Module that trains and applies a multiclass linear SVM in process, in place of the svm_multiclass executables"""
+from Sparse_Features import readFeatsFile, loadSparseFeatures, getFeatureCount, multiplyRows
+from BOW_Extractor import getUpdateFingerprint
+import Feature_Converter as converter
+import numpy as np
+import argparse
+import os
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Trains a Crammer-Singer multiclass SVM on the training tweets and writes the predictions for the test tweets in the svm_multiclass_classify format')
+    parser.add_argument('-c', type = float, default = 1000.0, help = 'Trade-off between training error and margin, as in svm_multiclass_learn (default: %(default)s)')
+    parser.add_argument('--source', choices = ['tweets', 'feats', 'csr'], default = 'tweets', help = 'Convert the tweet files in process with feats.dic, read tc_out/feats.train and tc_out/feats.test (or their .gz versions if written more recently), or memory map tc_out/feats.train.csr and tc_out/feats.test.csr (default: %(default)s)')
+    parser.add_argument('--epochs', type = int, default = 100, help = 'Maximum number of passes over the training tweets (default: %(default)s)')
+    parser.add_argument('--tolerance', type = float, default = 0.01, help = 'Stop once no tweet violates the optimality conditions by more than this (default: %(default)s)')
+    parser.add_argument('--model', default = 'svm_linux/model.npz', help = 'Where to save the weights (default: %(default)s)')
+    parser.add_argument('--predictions', default = 'svm_linux/pred.out', help = 'Where to write the predictions (default: %(default)s)')
+    parser.add_argument('--update', metavar = 'PATH', help = 'Tweet file of new labelled tweets, after the --update runs of BOW_Extractor.py (and Feature_Converter.py for --source feats) - warm start from --model and train on these tweets only')
+    arguments = parser.parse_args()
+    if arguments.update and arguments.source == 'csr':
+        parser.error('--update reads the new tweets from the tweet file or tc_out/feats.update and cannot be combined with --source csr')
+
+    weights, tweetCount, updates = None, 0, []
+    if arguments.update:
+        weights, tweetCount, updates = loadModel(arguments.model) # The model trained on the tweets so far
+        updateFingerprint = getUpdateFingerprint(arguments.update)
+        if updateFingerprint in updates:
+            print('{} was already trained into {} - skipped'.format(arguments.update, arguments.model))
+            return
+        updates.append(updateFingerprint)
+
+    if arguments.source == 'tweets':
+        converter.importFeatsToDictionary('tc_out/feats.dic')
+        converter.importCategoriesToDictionary('files/classIDs.txt')
+        if arguments.update:
+            trainFeatures = converter.convertTweetFileToSparseFeatures(arguments.update, 'tc_out/feats.update.corpus.npz')
+        else:
+            trainFeatures = converter.convertTweetFileToSparseFeatures('tweets/Tweets.14cat.train', 'tc_out/feats.corpus.npz')
+        testFeatures = converter.convertTweetFileToSparseFeatures('tweets/Tweets.14cat.test')
+    elif arguments.source == 'csr':
+        trainFeatures = loadSparseFeatures('tc_out/feats.train.csr')
+        testFeatures = loadSparseFeatures('tc_out/feats.test.csr')
+    else:
+        trainFeatures = readFeatsFile(getFeatsPath('tc_out/feats.update' if arguments.update else 'tc_out/feats.train'))
+        testFeatures = readFeatsFile(getFeatsPath('tc_out/feats.test'))
+
+    weights = trainCrammerSinger(trainFeatures, arguments.c, arguments.epochs, arguments.tolerance, weights = weights, previousCount = tweetCount)
+    saveModel(arguments.model, weights, tweetCount + len(trainFeatures.labels), updates)
+    exportPredictions(arguments.predictions, multiplyRows(testFeatures, weights), testFeatures.tweetIDs)
+
+def trainCrammerSinger(features, c = 1000.0, epochs = 100, tolerance = 0.01, seed = 0, lossScale = 100.0, weights = None, previousCount = 0):
+    """Trains a Crammer-Singer multiclass SVM with dual coordinate descent (Keerthi et al., 2008): every step solves the
+    dual subproblem of one tweet exactly and updates the weights of its terms
+
+    The objective is the one of svm_multiclass_learn, 1/2 ||W||^2 + c / n * sum of the tweets' multiclass hinge losses
+    with a margin of lossScale, so the same -c gives a comparable model. It is solved as the equivalent problem with a
+    margin of 1 and c / lossScale, whose weights are then multiplied by lossScale.
+
+    Given the weights of a model trained on previousCount earlier tweets, training continues from them and only the
+    dual variables of the new tweets are optimized - those of the earlier tweets stay as they are, folded into the
+    weights - so the cost depends on the number of new tweets only.
+
+    Parameters
+    ----------
+    features : SparseFeatures type
+        The training tweets, with class IDs 1 to the number of classes
+    c : Float type
+        Trade-off between training error and margin
+    epochs : Integer type
+        Maximum number of passes over the tweets
+    tolerance : Float type
+        Stop once the largest violation of the optimality conditions in a pass is below this
+    seed : Integer type
+        Seed of the order in which tweets are visited
+    lossScale : Float type
+        Loss of a wrong class - svm_multiclass_learn scales its 0/1 loss to 100
+    weights : Numpy array type
+        Weights to start from, as returned by an earlier call - None to start from zero
+    previousCount : Integer type
+        Number of tweets the starting weights were trained on
+
+    Returns
+    -------
+    weights : Numpy array type
+        Matrix (term IDs x classes), where column k holds the weights of class ID k + 1
+    """
+    labels = features.labels - 1
+    count = len(labels)
+    startWeights = weights if weights is not None else np.zeros((0, 0), dtype = np.float64)
+    classCount = max(int(labels.max()) + 1, startWeights.shape[1])
+    bound = c / lossScale / (previousCount + count) # Upper bound of a tweet's dual variable of its own class
+    weights = np.zeros((max(getFeatureCount(features), startWeights.shape[0]), classCount), dtype = np.float64)
+    weights[:startWeights.shape[0], :startWeights.shape[1]] = startWeights / lossScale # Rows of new term IDs and columns of new classes start at zero
+    alphas = np.zeros((count, classCount), dtype = np.float64)
+    indptr = features.indptr
+    indices = features.indices
+    squaredNorms = np.diff(indptr).astype(np.float64) # Binary features
+    randomState = np.random.RandomState(seed)
+
+    for _ in range(epochs):
+        largestViolation = 0.0
+        for i in randomState.permutation(count):
+            norm = squaredNorms[i]
+            if norm == 0: # A tweet without known terms does not affect the weights
+                continue
+            termIDs = indices[indptr[i]:indptr[i + 1]]
+            label = labels[i]
+            alpha = alphas[i]
+            gradient = weights[termIDs].sum(axis = 0) + 1.0
+            gradient[label] -= 1.0
+            bounds = np.zeros(classCount)
+            bounds[label] = bound
+            violation = gradient.max() - gradient[alpha < bounds].min()
+            if violation <= 1e-12:
+                continue
+            largestViolation = max(largestViolation, violation)
+            newAlpha = solveSubproblem(gradient - norm * alpha, norm, label, bound, bounds)
+            weights[termIDs] += newAlpha - alpha
+            alphas[i] = newAlpha
+        if largestViolation < tolerance:
+            break
+    return weights * lossScale
+
+def solveSubproblem(b, norm, label, bound, bounds):
+    """Solves the dual subproblem of one tweet, min sum_m (norm / 2 * alpha_m^2 + b_m * alpha_m) subject to
+    sum_m alpha_m = 0 and alpha_m <= bounds_m
+
+    Parameters
+    ----------
+    b : Numpy array type
+        The linear coefficient of every class
+    norm : Float type
+        The tweet's squared norm
+    label : Integer type
+        The column of the tweet's class
+    bound : Float type
+        The bound of the tweet's class - every other class is bounded by 0
+    bounds : Numpy array type
+        The bound of every class
+
+    Returns
+    -------
+    alpha : Numpy array type
+        The optimal dual variables
+    """
+    d = b.copy()
+    d[label] += norm * bound
+    d = -np.sort(-d) # Descending
+    beta = d[0] - norm * bound
+    r = 1
+    while r < len(d) and beta < r * d[r]:
+        beta += d[r]
+        r += 1
+    beta /= r
+    return np.minimum(bounds, (beta - b) / norm)
+
+def getFeatsPath(pathToFile):
+    """Returns the feats file Feature_Converter.py wrote last - with --gzip it writes the file with '.gz' appended
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the uncompressed feats file
+
+    Returns
+    -------
+    pathToFeatsFile : String type
+        The more recently modified of the file and its gzip compressed version
+    """
+    compressedPath = pathToFile + '.gz'
+    if not os.path.exists(compressedPath):
+        return pathToFile
+    if not os.path.exists(pathToFile) or os.path.getmtime(compressedPath) >= os.path.getmtime(pathToFile):
+        return compressedPath
+    return pathToFile
+
+def saveModel(pathToFile, weights, tweetCount, updates = ()):
+    """Saves the weights of a trained model
+
+    Parameters
+    ----------
+    pathToFile : String type
+        Path leading to the model file
+    weights : Numpy array type
+        Matrix (term IDs x classes)
+    tweetCount : Integer type
+        Number of tweets the model was trained on
+    updates : List of strings
+        Fingerprints of the update files the model was trained on since its full training
+    """
+    path = pathToFile.rsplit('/', 1)[0]
+    if not os.path.exists(path): # Check whether the directory exists or not
+        os.makedirs(path)
+    temporaryPath = '{}.{}.tmp'.format(pathToFile, os.getpid())
+    with open(temporaryPath, 'wb') as output:
+        np.savez(output, weights = weights, tweetCount = np.int64(tweetCount), updates = np.array(list(updates), dtype = np.str_))
+    os.rename(temporaryPath, pathToFile) # An interrupted update leaves the previous model intact
+
+def loadModel(pathToFile):
+    """Loads the weights of a trained model
+
+    Parameters
+    ----------
+    pathToFile : String type
+        Path leading to the model file
+
+    Returns
+    -------
+    weights : Numpy array type
+        Matrix (term IDs x classes)
+    tweetCount : Integer type
+        Number of tweets the model was trained on
+    updates : List of strings
+        Fingerprints of the update files the model was trained on since its full training
+    """
+    with np.load(pathToFile) as model:
+        return model['weights'], int(model['tweetCount']), model['updates'].tolist()
+
+def exportPredictions(pathToFile, scores, tweetIDs = None):
+    """Exports predictions in the format of svm_multiclass_classify, "classID score1 score2 ..." per tweet, followed by
+    "#tweetID" as in the feats files if the tweet IDs are given, so Classifier_Evaluator.py can check the alignment
+
+    Parameters
+    ----------
+    pathToFile : String type
+        Path leading to the output file
+    scores : Numpy array type
+        Matrix (tweets x classes) of class scores
+    tweetIDs : List of strings
+        The ID of every tweet, None to leave out the trailers
+    """
+    predictions = scores.argmax(axis = 1) + 1
+    trailers = [' #{}'.format(tweetID) for tweetID in tweetIDs] if tweetIDs is not None else [''] * len(predictions)
+    with open(pathToFile, 'w') as output:
+        output.write(''.join('{} {}{}\n'.format(prediction, ' '.join('{:.6f}'.format(score) for score in row), trailer) for prediction, row, trailer in zip(predictions.tolist(), scores.tolist(), trailers)))
+
+if __name__ == '__main__':
+    main()
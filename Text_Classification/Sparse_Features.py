@@ -0,0 +1,210 @@
+"""Sparse_Features.py : Module that holds feats files as CSR sparse matrices of binary features"""
+from collections import namedtuple
+import numpy as np
+import gzip
+import os
+import re
+
+# Binary feature matrix in CSR layout: the term IDs of row i are indices[indptr[i]:indptr[i + 1]], in ascending order
+SparseFeatures = namedtuple('SparseFeatures', ['labels', 'indptr', 'indices', 'tweetIDs'])
+valuePattern = re.compile(r':\S*') # The ':1' after every term ID
+
+def createSparseFeatures(labels, rows, tweetIDs):
+    """Creates a CSR feature matrix from per tweet term IDs
+
+    Parameters
+    ----------
+    labels : List type
+        The class ID of every tweet
+    rows : List type
+        The term IDs of every tweet, each in ascending order
+    tweetIDs : List of strings
+        The ID of every tweet
+
+    Returns
+    -------
+    features : SparseFeatures type
+        The feature matrix
+    """
+    indptr = np.zeros(len(rows) + 1, dtype = np.int64)
+    indptr[1:] = np.cumsum([len(row) for row in rows])
+    indices = np.fromiter((termID for row in rows for termID in row), dtype = np.int32, count = indptr[-1])
+    return SparseFeatures(np.array(labels, dtype = np.int32), indptr, indices, list(tweetIDs))
+
+def readFeatsFile(pathToFile, chunkLines = 100000):
+    """Reads a feats file ("label termID:1 termID:1 #tweetID" lines, gzip compressed if the path ends with .gz)
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the file
+    chunkLines : Integer type
+        Number of lines parsed at a time
+
+    Returns
+    -------
+    features : SparseFeatures type
+        The feature matrix
+    """
+    return concatenateSparseFeatures(list(readFeatsFileChunks(pathToFile, chunkLines)))
+
+def readFeatsFileChunks(pathToFile, chunkLines = 100000):
+    """Reads a feats file a chunk of lines at a time, so files larger than memory can be processed chunk by chunk
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the file, gzip compressed if it ends with .gz
+    chunkLines : Integer type
+        Number of lines per chunk
+
+    Returns
+    -------
+    chunks : Generator type
+        SparseFeatures of every chunk of lines, in file order
+    """
+    with (gzip.open(pathToFile, 'rb') if pathToFile.endswith('.gz') else open(pathToFile, 'r')) as file:
+        lines = []
+        for line in file:
+            if line == "\n": # Skip empty lines
+                continue
+            lines.append(line)
+            if len(lines) == chunkLines:
+                yield parseFeatsLines(lines)
+                lines = []
+        if lines:
+            yield parseFeatsLines(lines)
+
+def parseFeatsLines(lines):
+    """Parses feats file lines - the numbers of all lines are converted by a single numpy call
+
+    Parameters
+    ----------
+    lines : List of strings
+        The lines, "label termID:1 termID:1 #tweetID"
+
+    Returns
+    -------
+    features : SparseFeatures type
+        The feature matrix of the lines
+    """
+    entries = []
+    tweetIDs = []
+    for line in lines:
+        entry, _, tweetID = line.rstrip('\n').partition('#')
+        entries.append(entry)
+        tweetIDs.append(tweetID)
+    lengths = np.array([entry.count(':') for entry in entries], dtype = np.int64) # Term IDs per line
+    numbers = np.fromstring(valuePattern.sub('', ' '.join(entries)), dtype = np.int64, sep = ' ') # Label, term IDs, label, ...
+    labelPositions = np.zeros(len(entries), dtype = np.int64)
+    labelPositions[1:] = np.cumsum(lengths + 1)[:-1]
+    isTermID = np.ones(len(numbers), dtype = bool)
+    isTermID[labelPositions] = False
+    indptr = np.zeros(len(entries) + 1, dtype = np.int64)
+    np.cumsum(lengths, out = indptr[1:])
+    return SparseFeatures(numbers[labelPositions].astype(np.int32), indptr, numbers[isTermID].astype(np.int32), tweetIDs)
+
+def concatenateSparseFeatures(chunks):
+    """Stacks the rows of feature matrices
+
+    Parameters
+    ----------
+    chunks : List type
+        SparseFeatures in row order
+
+    Returns
+    -------
+    features : SparseFeatures type
+        The feature matrix with the rows of all chunks
+    """
+    if not chunks:
+        return SparseFeatures(np.zeros(0, dtype = np.int32), np.zeros(1, dtype = np.int64), np.zeros(0, dtype = np.int32), [])
+    indptrs = [chunks[0].indptr]
+    end = chunks[0].indptr[-1]
+    for chunk in chunks[1:]:
+        indptrs.append(chunk.indptr[1:] + end)
+        end += chunk.indptr[-1]
+    tweetIDs = []
+    for chunk in chunks:
+        tweetIDs.extend(chunk.tweetIDs)
+    return SparseFeatures(np.concatenate([chunk.labels for chunk in chunks]), np.concatenate(indptrs), np.concatenate([chunk.indices for chunk in chunks]), tweetIDs)
+
+def saveSparseFeatures(pathToDirectory, features):
+    """Saves a feature matrix as one .npy file per array (labels, indptr, indices, tweetIDs), which loadSparseFeatures
+    can memory map
+
+    Parameters
+    ----------
+    pathToDirectory : String type
+        Path leading to the output directory, e.g. tc_out/feats.train.csr
+    features : SparseFeatures type
+        The feature matrix
+    """
+    if not os.path.exists(pathToDirectory): # Check whether the directory exists or not
+        os.makedirs(pathToDirectory)
+    arrays = [('labels', np.asarray(features.labels, dtype = np.int32)), ('indptr', np.asarray(features.indptr, dtype = np.int64)),
+              ('indices', np.asarray(features.indices, dtype = np.int32)), ('tweetIDs', np.array(features.tweetIDs, dtype = np.str_))]
+    for name, array in arrays:
+        temporaryPath = os.path.join(pathToDirectory, '{}.{}.tmp'.format(name, os.getpid()))
+        with open(temporaryPath, 'wb') as output:
+            np.save(output, array)
+        os.rename(temporaryPath, os.path.join(pathToDirectory, name + '.npy'))
+
+def loadSparseFeatures(pathToDirectory, memoryMap = True):
+    """Loads a feature matrix saved by saveSparseFeatures
+
+    Parameters
+    ----------
+    pathToDirectory : String type
+        Path leading to the directory
+    memoryMap : Boolean type
+        Whether to memory map the arrays instead of reading them - only the pages that are used are read from disk
+
+    Returns
+    -------
+    features : SparseFeatures type
+        The feature matrix - tweetIDs is an array of strings
+    """
+    mode = 'r' if memoryMap else None
+    arrays = [np.load(os.path.join(pathToDirectory, name + '.npy'), mmap_mode = mode) for name in SparseFeatures._fields]
+    return SparseFeatures(*arrays)
+
+def getFeatureCount(features):
+    """Returns the number of columns of a feature matrix - term IDs start at 1, so column 0 is always empty
+
+    Parameters
+    ----------
+    features : SparseFeatures type
+        The feature matrix
+
+    Returns
+    -------
+    count : Integer type
+        The largest term ID plus one
+    """
+    return int(features.indices.max()) + 1 if len(features.indices) else 1
+
+def multiplyRows(features, weights):
+    """Multiplies the binary feature matrix with a weight matrix, i.e. sums the weight rows of every tweet's term IDs
+
+    Parameters
+    ----------
+    features : SparseFeatures type
+        The feature matrix
+    weights : Numpy array type
+        Matrix (term IDs x columns) - term IDs beyond its rows are ignored
+
+    Returns
+    -------
+    products : Numpy array type
+        Matrix (tweets x columns)
+    """
+    indices = features.indices
+    known = indices < weights.shape[0] # Terms unseen in training have no weights
+    values = weights[np.where(known, indices, 0)] * known[:, np.newaxis]
+    starts = features.indptr[:-1]
+    nonEmpty = features.indptr[1:] > starts # reduceat cannot express empty rows
+    products = np.zeros((len(starts), weights.shape[1]), dtype = np.float64)
+    if nonEmpty.any():
+        products[nonEmpty] = np.add.reduceat(values, starts[nonEmpty], axis = 0)
+    return products
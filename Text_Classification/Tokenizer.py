@@ -0,0 +1,130 @@
+"""Tokenizer.py : Module that tokenizes tweets for both the baseline and the improved classifier"""
+import argparse
+import time
+import re
+
+linkPattern = re.compile(r'https?:\/\/[^\s]+') # Links - either http or https
+termPattern = re.compile(r'\w+') # Runs between non alphabetical characters - same terms as splitting on r'\W+' (baseline)
+termUnderscorePattern = re.compile(r'[^\W_]+') # Runs between non alphabetical characters and underscores - same terms as splitting on r'_|\W+' (improved)
+
+class Tokenizer(object):
+    """Removes links, optionally lower cases, extracts the terms and filters stopwords of tweets with precompiled patterns
+
+    Parameters
+    ----------
+    lowercase : Boolean type
+        Whether to lower case the text after removing its links
+    splitUnderscores : Boolean type
+        Whether underscores separate terms too
+    stopwords : Set type
+        Terms to leave out, None to keep all terms
+    """
+
+    def __init__(self, lowercase = False, splitUnderscores = False, stopwords = None):
+        self.lowercase = lowercase
+        self.termPattern = termUnderscorePattern if splitUnderscores else termPattern
+        self.stopwords = stopwords if stopwords is not None else frozenset()
+
+    def tokenize(self, tweet):
+        """Returns the terms of a tweet
+
+        Parameters
+        ----------
+        tweet : String type
+            The tweet's text
+
+        Returns
+        -------
+        terms : List of strings
+            The non empty terms that are not stopwords, in tweet order
+        """
+        text = linkPattern.sub('', tweet)
+        if self.lowercase:
+            text = text.lower()
+        stopwords = self.stopwords
+        if not stopwords:
+            return self.termPattern.findall(text)
+        return [term for term in self.termPattern.findall(text) if term not in stopwords]
+
+    def tokenizeBatch(self, tweets):
+        """Returns the terms of every tweet of a list - links are removed and text lower cased for the whole batch at once
+
+        Parameters
+        ----------
+        tweets : List of strings
+            The tweets' texts, none of which contains a line break
+
+        Returns
+        -------
+        terms : List type
+            One list of terms per tweet, as returned by tokenize
+        """
+        if not tweets:
+            return []
+        text = linkPattern.sub('', '\n'.join(tweets)) # Links never span lines, so tweets stay separate
+        if self.lowercase:
+            text = text.lower()
+        findall = self.termPattern.findall
+        stopwords = self.stopwords
+        if not stopwords:
+            return [findall(line) for line in text.split('\n')]
+        return [[term for term in findall(line) if term not in stopwords] for line in text.split('\n')]
+
+def getLinks(text):
+    """Returns links from given text - either http or https.
+
+    Parameters
+    ----------
+    text : String type
+        A text string which may contain links
+
+    Returns
+    -------
+    links : List type
+        The links within the text
+    """
+    return linkPattern.findall(text)
+
+def benchmark(pathToFile, pathToStopwords, repeats):
+    """Compares the tokenizers with the per call regular expressions they replace on the tweets of a file, checking that
+    both give the same terms, and prints the times
+
+    Parameters
+    ----------
+    pathToFile : String type
+        The path leading to the tweet file
+    pathToStopwords : String type
+        The path leading to the stopword file of the improved classifier
+    repeats : Integer type
+        Number of passes over the file that are timed
+    """
+    with open(pathToFile, 'r') as file:
+        tweets = [line.strip().split("\t")[1] for line in file if line != "\n"]
+    with open(pathToStopwords) as stopWordFile:
+        stopwords = set(stopWordFile.read().splitlines())
+
+    def baseline(tweet):
+        return filter(None, re.split(r'\W+', re.sub(r'https?:\/\/[^\s]+', '', tweet)))
+
+    def improved(tweet):
+        return [term for term in filter(None, re.split(r'_|\W+', re.sub(r'https?:\/\/[^\s]+', '', tweet).lower())) if term not in stopwords]
+
+    for name, function, tokenizer in (('baseline', baseline, Tokenizer()), ('improved', improved, Tokenizer(True, True, stopwords))):
+        expected = map(function, tweets)
+        if map(tokenizer.tokenize, tweets) != expected or tokenizer.tokenizeBatch(tweets) != expected:
+            raise AssertionError('Tokenizer output differs from the {} functions'.format(name))
+        timings = []
+        for run in (lambda: map(function, tweets), lambda: map(tokenizer.tokenize, tweets), lambda: tokenizer.tokenizeBatch(tweets)):
+            start = time.time()
+            for _ in range(repeats):
+                run()
+            timings.append((time.time() - start) / repeats)
+        print('{}: {} tweets - functions {:.4f}s, tokenize {:.4f}s, tokenizeBatch {:.4f}s (identical terms)'.format(name, len(tweets), *timings))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmarks the tokenizers against the per call regular expressions on a tweet file')
+    parser.add_argument('--tweets', default = 'tweets/Tweets.14cat.train', help = 'The tweet file (default: %(default)s)')
+    parser.add_argument('--stopwords', default = 'Improved_Classifier/files/stopwords.txt', help = 'The stopword file (default: %(default)s)')
+    parser.add_argument('--repeats', type = int, default = 20, help = 'Number of timed passes (default: %(default)s)')
+    arguments = parser.parse_args()
+    benchmark(arguments.tweets, arguments.stopwords, arguments.repeats)